@@ -8,15 +8,31 @@ from django.dispatch import Signal
 from django.db.models import signals
 
 from .util import (
-    create_moderate_perms, add_fields, save_handler, delete_handler
+    create_moderate_perms, add_fields, save_handler, delete_handler,
+    compile_monitor_meta
 )
 
 _queue = {}
+# Compiled MonitorMeta of enqueued models, filled on first use.
+_monitor_meta = {}
 
 def model_from_queue(model):
     """ Returns the model dict if model is enqueued, else None."""
     return _queue.get(model, None)
 
+def get_monitor_meta(model):
+    """
+    Returns the MonitorMeta of the model if model is enqueued, else None.
+    It is compiled on first use, since content types need the database.
+    """
+    try:
+        return _monitor_meta[model]
+    except KeyError:
+        if not model_from_queue(model):
+            return None
+        meta = _monitor_meta[model] = compile_monitor_meta(model)
+        return meta
+
 def queued_models():
     """ Return the models enqueued for moderation"""
     return _queue.keys()
@@ -33,7 +49,8 @@ def get_monitor_entry(obj):
 def nq(
     model, rel_fields = [], can_delete_approved = True,
     manager_name = 'objects', status_name = 'status',
-    monitor_name = 'monitor_entry', base_manager = None
+    monitor_name = 'monitor_entry', base_manager = None,
+    instance_signals = False
 ):
     """ Register(enqueue) the model for moderation."""
     if not model_from_queue(model):
@@ -51,10 +68,13 @@ def nq(
             'can_delete_approved': can_delete_approved,
             'manager_name': manager_name,
             'status_name': status_name,
-            'monitor_name': monitor_name
+            'monitor_name': monitor_name,
+            'instance_signals': instance_signals
         }
 
 post_moderation = Signal(providing_args = ["instance"])
+# Sent once per model by bulk moderation, with the pks of all objects changed.
+post_bulk_moderation = Signal(providing_args = ["pks", "status", "user"])
 
 signals.post_migrate.connect(
     create_moderate_perms,
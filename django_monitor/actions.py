@@ -2,12 +2,14 @@ from django.core.exceptions import PermissionDenied
 from django.contrib.admin.utils import model_ngettext
 from django.utils.translation import ugettext_lazy, ugettext as _
 
+from django_monitor.instrument import measured
 from django_monitor.util import moderate_rel_objects
 from django_monitor import model_from_queue
-from django_monitor.conf import (STATUS_DICT, PENDING_STATUS, APPROVED_STATUS,
-                                 CHALLENGED_STATUS)
+from django_monitor.conf import (PENDING_STATUS, APPROVED_STATUS,
+                                 CHALLENGED_STATUS, DEFER_CASCADE)
 
 
+@measured('moderate_selected', objects = lambda count: count)
 def moderate_selected(modeladmin, request, queryset, status):
     """
     Generic action to moderate selected objects plus all related objects.
@@ -33,20 +35,12 @@ def moderate_selected(modeladmin, request, queryset, status):
     # Approved objects can not further be moderated.
     queryset = queryset.exclude_approved()
 
-    # After moderating objects in queryset, moderate related objects also
-    q_count = queryset.count()
-
-    # We want to use the status display rather than abbreviations in logs.
-    status_display = STATUS_DICT[status]
-
-    if q_count:
-        #for obj in queryset:
-            #message = 'Changed status from %s to %s.' % (
-            #    obj.get_status_display(), status_display
-            #)
-            #modeladmin.log_moderation(request, obj, message)
-            #me = MonitorEntry.objects.get_for_instance(obj)
-        moderate_rel_objects(queryset, status, request.user)
+    # Moderate the selected objects along with their related objects. Every
+    # change is recorded in MonitorEvent.
+    q_count = moderate_rel_objects(
+        queryset, status, request.user,
+        defer = getattr(modeladmin, 'defer_cascade', DEFER_CASCADE)
+    )
     return q_count
 
 
@@ -1,24 +1,69 @@
+from datetime import datetime, timedelta
 from functools import update_wrapper
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.contenttypes.models import ContentType
 
+from django.core.urlresolvers import reverse
 from django.shortcuts import render
 from django.template import RequestContext
 from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext as _
 
 from django_monitor.actions import (approve_selected, challenge_selected,
                                     reset_to_pending)
 from django_monitor.filter import MonitorFilter
-from django_monitor import model_from_queue, queued_models
+from django_monitor import get_monitor_meta, model_from_queue, queued_models
 from django_monitor.conf import (PENDING_STATUS, CHALLENGED_STATUS,
-                                 APPROVED_STATUS, PENDING_DESCR,
-                                 CHALLENGED_DESCR)
-from django_monitor.models import MonitorEntry
+                                 PENDING_DESCR,
+                                 CHALLENGED_DESCR, DEFER_CASCADE, SLA)
+from django_monitor.models import MonitorEntry, MonitorCounter
 
 
-MonitorFilter.register(
-    lambda f: getattr(f, 'monitor_filter', False), MonitorFilter, True
-)
+def has_custom_queryset(model_admin):
+    """
+    Returns True if the model_admin overrides ``get_queryset`` (or the old
+    ``queryset``), ie. it may not let users see all objects of the model.
+    """
+    for klass in type(model_admin).__mro__:
+        if klass in (MonitorAdmin, admin.ModelAdmin):
+            return False
+        if 'get_queryset' in vars(klass) or 'queryset' in vars(klass):
+            return True
+    return False
+
+
+QUEUE_CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def format_queue_cursor(entry):
+    """ Encodes the queue position of the entry for use in urls."""
+    timestamp, entry_id = entry.queue_cursor
+    return '%s_%d' % (timestamp.strftime(QUEUE_CURSOR_FORMAT), entry_id)
+
+
+def parse_queue_cursor(value):
+    """ Decodes a cursor made by format_queue_cursor. None if invalid."""
+    try:
+        timestamp, entry_id = value.split('_')
+        return (
+            datetime.strptime(timestamp, QUEUE_CURSOR_FORMAT), int(entry_id)
+        )
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_age(age):
+    """ Short, human readable form of a timedelta, eg. '2d 5h' or '7m'."""
+    seconds = int(age.total_seconds())
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes = seconds // 60
+    if days:
+        return '%dd %dh' % (days, hours)
+    if hours:
+        return '%dh %dm' % (hours, minutes)
+    return '%dm' % minutes
 
 
 class MEAdmin(admin.ModelAdmin):
@@ -29,9 +74,14 @@ class MEAdmin(admin.ModelAdmin):
     to get notified about pending/challenged model objects.
     """
     change_list_template = 'admin/django_monitor/monitorentry/change_list.html'
+    queue_template = 'admin/django_monitor/monitorentry/queue.html'
+    stats_template = 'admin/django_monitor/monitorentry/stats.html'
 
     def get_urls(self):
-        """The only url allowed is that for changelist_view. """
+        """
+        The only urls allowed are those for changelist_view, queue_view &
+        stats_view.
+        """
         from django.conf.urls import url
 
         def wrap(view):
@@ -46,6 +96,14 @@ class MEAdmin(admin.ModelAdmin):
                 wrap(self.changelist_view),
                 name = '%s_%s_changelist' % info
             ),
+            url(r'^queue/$',
+                wrap(self.queue_view),
+                name = '%s_%s_queue' % info
+            ),
+            url(r'^stats/$',
+                wrap(self.stats_view),
+                name = '%s_%s_stats' % info
+            ),
         ]
         return urlpatterns
 
@@ -71,6 +129,7 @@ class MEAdmin(admin.ModelAdmin):
         moderation summary aggregated for each model.
         """
         model_list = []
+        admins = []
         for model in queued_models():
             # I do not like to access private objects. No other option here!
             # Get only those objects developer wish to let user see..
@@ -82,9 +141,33 @@ class MEAdmin(admin.ModelAdmin):
                 # but the admin_site registry knows only those models in
                 # ``django_monitor.tests.apps.testapp.models``.
                 continue
+            admins.append((model, model_admin))
 
-            ip_count = model_admin.get_queryset(request).pending().count()
-            ch_count = model_admin.get_queryset(request).challenged().count()
+        # Models whose admin shows all objects are read from the counters
+        # maintained in MonitorCounter, with one query for all of them.
+        content_types = ContentType.objects.get_for_models(*[
+            model for model, model_admin in admins
+            if not has_custom_queryset(model_admin)
+        ])
+        counts = {}
+        if content_types:
+            counts = MonitorCounter.objects.counts(
+                content_types = [ct.id for ct in content_types.values()],
+                statuses = [PENDING_STATUS, CHALLENGED_STATUS]
+            )
+
+        for model, model_admin in admins:
+            if model in content_types:
+                ct_id = content_types[model].id
+                ip_count = counts.get((ct_id, PENDING_STATUS), 0)
+                ch_count = counts.get((ct_id, CHALLENGED_STATUS), 0)
+            else:
+                # The admin may restrict the objects a user can see.
+                status_counts = model_admin.get_queryset(
+                    request
+                ).status_counts()
+                ip_count = status_counts[PENDING_STATUS]
+                ch_count = status_counts[CHALLENGED_STATUS]
 
             app_label = model._meta.app_label
             if ip_count or ch_count:
@@ -107,6 +190,147 @@ class MEAdmin(admin.ModelAdmin):
             }
         )
 
+    def queue_view(self, request, extra_context = None):
+        """
+        Lists the oldest pending/challenged objects of all models the user
+        can change, a page at a time. Built on ``MonitorEntry.objects.queue``,
+        so that deep pages cost the same as the first one.
+        """
+        model_admins = {}
+        for model in queued_models():
+            model_admin = self.admin_site._registry.get(model)
+            if model_admin and model_admin.has_change_permission(request):
+                model_admins[model] = model_admin
+        content_types = ContentType.objects.get_for_models(*model_admins)
+        ct_ids = [ct.id for ct in content_types.values()]
+
+        status = request.GET.get('status')
+        if status in (PENDING_STATUS, CHALLENGED_STATUS):
+            statuses = [status]
+        else:
+            status, statuses = None, [PENDING_STATUS, CHALLENGED_STATUS]
+        try:
+            ct_id = int(request.GET.get('ct', ''))
+        except ValueError:
+            ct_id = None
+        if ct_id in ct_ids:
+            ct_ids = [ct_id]
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 50)), 500))
+        except ValueError:
+            limit = 50
+        after = parse_queue_cursor(request.GET.get('after'))
+
+        # One more entry tells whether there is a next page.
+        entries = list(
+            MonitorEntry.objects.queue(statuses, ct_ids, after, limit + 1)
+        )
+        has_next = len(entries) > limit
+        entries = entries[:limit]
+
+        # Load the objects with one query per model.
+        object_ids = {}
+        for me in entries:
+            object_ids.setdefault(me.content_type, []).append(me.object_id)
+        objects = {}
+        for ct, ids in object_ids.items():
+            model = ct.model_class()
+            if model is None:
+                continue
+            for pk, obj in model._base_manager.in_bulk(ids).items():
+                objects[(ct.id, pk)] = obj
+        rows = []
+        for me in entries:
+            model = me.content_type.model_class()
+            if model is None:
+                # The model is gone, see ``manage.py monitor_gc``.
+                rows.append({
+                    'entry': me, 'object': None,
+                    'model_name': '%s (removed)' % me.content_type.model,
+                    'admin_url': None,
+                })
+                continue
+            opts = model._meta
+            rows.append({
+                'entry': me,
+                'object': objects.get((me.content_type_id, me.object_id)),
+                'model_name': opts.verbose_name,
+                'admin_url': reverse(
+                    '%s:%s_%s_change' % (
+                        self.admin_site.name, opts.app_label, opts.model_name
+                    ),
+                    args = (me.object_id,)
+                ),
+            })
+
+        next_url = None
+        if has_next:
+            query = request.GET.copy()
+            query['after'] = format_queue_cursor(entries[-1])
+            next_url = '?%s' % query.urlencode()
+        context = {
+            'rows': rows,
+            'next_url': next_url,
+            'status': status,
+            'ip_status': PENDING_STATUS, 'ip_descr': PENDING_DESCR,
+            'ch_status': CHALLENGED_STATUS, 'ch_descr': CHALLENGED_DESCR
+        }
+        context.update(extra_context or {})
+        return render(request, self.queue_template, context)
+
+    def stats_view(self, request, extra_context = None):
+        """
+        How long pending/challenged objects of each model the user can change
+        have been waiting: oldest, median & 95th percentile ages, and the
+        number past the SLA (``sla`` hours in the url, or ``MONITOR_SLA``).
+        Computed in the database, see ``MonitorEntry.objects.age_stats``.
+        """
+        model_admins = {}
+        for model in queued_models():
+            model_admin = self.admin_site._registry.get(model)
+            if model_admin and model_admin.has_change_permission(request):
+                model_admins[model] = model_admin
+        content_types = ContentType.objects.get_for_models(*model_admins)
+
+        status = request.GET.get('status')
+        if status != CHALLENGED_STATUS:
+            status = PENDING_STATUS
+        try:
+            # Between a minute and a year.
+            hours = max(1 / 60.0, min(float(request.GET['sla']), 24 * 366))
+            sla = timedelta(hours = hours)
+        except (KeyError, ValueError, OverflowError):
+            sla = timedelta(seconds = SLA)
+
+        stats = MonitorEntry.objects.age_stats(
+            status, [ct.id for ct in content_types.values()],
+            (0.5, 0.95), sla
+        )
+        rows = []
+        for model, ct in content_types.items():
+            if ct.id not in stats:
+                continue
+            age = stats[ct.id]
+            rows.append({
+                'model_name': model._meta.verbose_name,
+                'count': age.count,
+                'oldest': format_age(age.oldest),
+                'median': format_age(age.percentiles[0.5]),
+                'p95': format_age(age.percentiles[0.95]),
+                'over_sla': age.over_sla,
+                'exact': age.exact,
+            })
+        rows.sort(key = lambda row: row['model_name'])
+        context = {
+            'rows': rows,
+            'status': status,
+            'sla': format_age(sla),
+            'ip_status': PENDING_STATUS, 'ip_descr': PENDING_DESCR,
+            'ch_status': CHALLENGED_STATUS, 'ch_descr': CHALLENGED_DESCR
+        }
+        context.update(extra_context or {})
+        return render(request, self.stats_template, context)
+
 admin.site.register(MonitorEntry, MEAdmin)
 
 
@@ -115,41 +339,65 @@ class MonitorAdmin(admin.ModelAdmin):
 
     # Which fields are to be made readonly after approval.
     protected_fields = ()
+    # Whether the moderation actions leave related objects to monitor_jobs.
+    defer_cascade = DEFER_CASCADE
 
     def __init__(self, model, admin_site):
         """ Overridden to add a custom filter to list_filter """
         super(MonitorAdmin, self).__init__(model, admin_site)
-        self.list_filter = ['id'] + list(self.list_filter)
+        if self.is_monitored():
+            self.list_filter = list(self.list_filter) + [MonitorFilter]
         self.list_display = (
             list(self.list_display) + ['get_monitor_status_display']
         )
 
     def get_queryset(self, request):
         """
-        Django does not allow using non-fields in list_filter. (As of 1.3).
-        Using params not mentioned in list_filter will raise error in changelist.
-        We want to enable status based filtering (status is not a db_field).
-        We will check the request.GET here and if there's a `status` in it,
-        Remove that and filter the qs by status.
+        Extended to load the status of each object along with it. Filtering
+        by status is done by ``MonitorFilter``.
         """
         qs = super(MonitorAdmin, self).get_queryset(request)
-        status = request.GET.get('status', None)
-        # status is not among list_filter entries. So its presence will raise
-        # IncorrectLookupParameters when django tries to build-up changelist.
-        # So let's remove it from GET dict (Still available in the url.)
-        if status:
-            get_dict = request.GET.copy()
-            del get_dict['status']
-            request.GET = get_dict
-        # ChangeList will use this custom queryset. So we've done it!
-        if status and status == PENDING_STATUS:
-            qs = qs.pending()
-        elif status and status == CHALLENGED_STATUS:
-            qs = qs.challenged()
-        elif status and status == APPROVED_STATUS:
-            qs = qs.approved()
+        # The changelist displays the status of each object.
+        if self.is_monitored():
+            qs = qs.with_status()
         return qs
 
+    def report_cascades(self, request):
+        """
+        Tells the user if related objects are still being moderated, or
+        could not be moderated at all (see ``manage.py monitor_jobs``).
+        """
+        from django_monitor.models import MonitorJob
+        ct_ids = [get_monitor_meta(self.model).content_type_id]
+        items = self.opts.verbose_name_plural
+        if MonitorJob.objects.failed(ct_ids).exists():
+            self.message_user(
+                request,
+                _(
+                    "Related objects of some %(items)s could not be "
+                    "moderated, see monitor_jobs."
+                ) % {"items": items},
+                messages.ERROR
+            )
+        if MonitorJob.objects.unfinished(ct_ids).exists():
+            self.message_user(
+                request,
+                _("Related objects of some %(items)s are still being moderated.")
+                % {"items": items},
+                messages.WARNING
+            )
+
+    def changelist_view(self, request, extra_context = None):
+        """ Extended to tell about cascades in progress or failed."""
+        if (
+            request.method == 'GET' and self.defer_cascade and
+            self.is_monitored()
+        ):
+            self.report_cascades(request)
+        return super(MonitorAdmin, self).changelist_view(
+            request, extra_context
+        )
+
     def is_monitored(self):
         """Returns whether the underlying model is monitored or not."""
         return bool(model_from_queue(self.model))
@@ -166,11 +414,11 @@ class MonitorAdmin(admin.ModelAdmin):
     def get_actions(self, request):
         """ For monitored models, we need 3 more actions."""
         actions = super(MonitorAdmin, self).get_actions(request)
-        mod_perm = '%s.moderate_%s' % (
-            self.opts.app_label.lower(), self.opts.object_name.lower()
-        )
-        change_perm = mod_perm.replace('moderate', 'change')
-        if request.user.has_perm(mod_perm):
+        meta = get_monitor_meta(self.model)
+        if not meta:
+            return actions
+        change_perm = meta.perm.replace('moderate', 'change')
+        if request.user.has_perm(meta.perm):
             descr = getattr(
                 approve_selected, 'short_description', 'approve selected'
             )
@@ -197,10 +445,8 @@ class MonitorAdmin(admin.ModelAdmin):
         Returns true if the given request has permission to moderate objects
         of the model corresponding to this model admin.
         """
-        mod_perm = '%s.moderate_%s' % (
-            self.opts.app_label.lower(), self.opts.object_name.lower()
-        )
-        return request.user.has_perm(mod_perm)
+        meta = get_monitor_meta(self.model)
+        return bool(meta) and request.user.has_perm(meta.perm)
 
     def has_delete_permission(self, request, obj = None):
         """
@@ -0,0 +1,160 @@
+"""
+Async counterparts of the moderation API, for ASGI deployments (Python 3
+only). ``django_monitor.models`` attaches them to the moderated models,
+their querysets and the managers when asgiref is available. The async side of
+``MonitorMiddleware`` lives here too.
+
+Reads use the async ORM of Django 4.1+ and fall back to ``sync_to_async``
+on older versions. Moderation runs several queries in a transaction, so it is
+done in one ``sync_to_async`` call. Calls are thread sensitive, ie. they all
+share one thread & its database connection instead of holding a thread per
+call, and can be awaited side by side.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import models
+
+# Django 4.1+ runs the reads of querysets natively.
+ASYNC_ORM = hasattr(models.QuerySet, 'acount')
+
+
+async def alist(qset):
+    """ Fetches the objects of the queryset into a list."""
+    if ASYNC_ORM:
+        return [obj async for obj in qset]
+    return await sync_to_async(list)(qset)
+
+
+# MonitoredObjectMixin
+
+async def aget_monitor_entry(self):
+    """ Async ``monitor_entry``. Caches the entry as the property does."""
+    if not hasattr(self, '_monitor_entry'):
+        from django_monitor.models import MonitorEntry
+        self._monitor_entry = await MonitorEntry.objects.aget_for_instance(
+            self
+        )
+    return self._monitor_entry
+
+
+async def amoderate(self, status, user = None, notes = ''):
+    """ Async ``moderate``, for objects and querysets alike."""
+    return await sync_to_async(self.moderate)(status, user, notes)
+
+
+async def aapprove(self, user = None, notes = ''):
+    return await sync_to_async(self.approve)(user, notes)
+
+
+async def achallenge(self, user = None, notes = ''):
+    return await sync_to_async(self.challenge)(user, notes)
+
+
+async def areset_to_pending(self, user = None, notes = ''):
+    return await sync_to_async(self.reset_to_pending)(user, notes)
+
+
+# MonitoredObjectQuerySet, where Django has no async ORM.
+
+async def acount(self):
+    return await sync_to_async(self.count)()
+
+
+def aiter_fallback(self):
+    """ ``async for`` over the queryset, which is fetched in one go."""
+    async def generator():
+        for obj in await sync_to_async(list)(self):
+            yield obj
+    return generator()
+
+
+# MonitorEntryManager
+
+async def aget_for_instance(self, obj):
+    """ Async ``get_for_instance``."""
+    from django.contrib.contenttypes.models import ContentType
+    ct = await sync_to_async(ContentType.objects.get_for_model)(obj.__class__)
+    entries = self.filter(content_type = ct, object_id = obj.pk)
+    if ASYNC_ORM:
+        return await entries.afirst()
+    return await sync_to_async(entries.first)()
+
+
+async def aqueue(self, *args, **kwargs):
+    """ Async ``queue``. Returns a list of entries."""
+    return await alist(self.queue(*args, **kwargs))
+
+
+async def aclaim(self, *args, **kwargs):
+    """ Async ``claim``."""
+    return await sync_to_async(self.claim)(*args, **kwargs)
+
+
+# MonitorCounterManager
+
+async def acounts(self, *args, **kwargs):
+    """ Async ``counts``."""
+    return await sync_to_async(self.counts)(*args, **kwargs)
+
+
+# MonitorMiddleware
+
+def mark_async_middleware(middleware):
+    """
+    Marks the middleware as a coroutine function if it is to call an async
+    ``get_response``, as Django expects. Returns whether it is marked.
+    """
+    if not asyncio.iscoroutinefunction(middleware.get_response):
+        return False
+    try:
+        from asgiref.sync import markcoroutinefunction
+    except ImportError:
+        # asgiref < 3.6, which Django checks with asyncio.
+        middleware._is_coroutine = asyncio.coroutines._is_coroutine
+    else:
+        markcoroutinefunction(middleware)
+    return True
+
+
+async def call_async_middleware(middleware, request):
+    """ The async ``MonitorMiddleware.__call__``."""
+    from django_monitor.middleware import (
+        set_current_user, reset_current_user
+    )
+    token = set_current_user(getattr(request, 'user', None))
+    try:
+        return await middleware.get_response(request)
+    finally:
+        reset_current_user(token)
+
+
+def contribute_async_api():
+    """ Adds the async methods to the classes of django_monitor.models."""
+    from django_monitor.models import (
+        MonitoredObjectMixin, MonitoredObjectQuerySet, MonitorEntryManager,
+        MonitorCounterManager
+    )
+    for name, func in (
+        ('aget_monitor_entry', aget_monitor_entry),
+        ('amoderate', amoderate),
+        ('aapprove', aapprove),
+        ('achallenge', achallenge),
+        ('areset_to_pending', areset_to_pending),
+    ):
+        setattr(MonitoredObjectMixin, name, func)
+    for name, func in (
+        ('amoderate', amoderate),
+        ('aapprove', aapprove),
+        ('achallenge', achallenge),
+        ('areset_to_pending', areset_to_pending),
+    ):
+        setattr(MonitoredObjectQuerySet, name, func)
+    if not ASYNC_ORM:
+        MonitoredObjectQuerySet.acount = acount
+        MonitoredObjectQuerySet.__aiter__ = aiter_fallback
+    MonitorEntryManager.aget_for_instance = aget_for_instance
+    MonitorEntryManager.aqueue = aqueue
+    MonitorEntryManager.aclaim = aclaim
+    MonitorCounterManager.acounts = acounts
+
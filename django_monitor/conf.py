@@ -1,6 +1,8 @@
 """
 All status labels defined here.
 """
+from django.conf import settings
+
 PENDING_STATUS = 'IP'
 APPROVED_STATUS = 'AP'
 CHALLENGED_STATUS = 'CH'
@@ -14,3 +16,33 @@ STATUS_DICT = {
     APPROVED_STATUS: APPROVED_DESCR,
     CHALLENGED_STATUS: CHALLENGED_DESCR
 }
+
+# Bulk operations split long lists of pks into chunks of this size, to stay
+# within the limits on query parameters of the database backends.
+CHUNK_SIZE = getattr(settings, 'MONITOR_CHUNK_SIZE', 500)
+
+# Every moderation is appended to MonitorEvent unless switched off.
+HISTORY = getattr(settings, 'MONITOR_HISTORY', True)
+
+# Moderate the related objects of objects moderated in the admin later, by
+# ``manage.py monitor_jobs``, instead of within the request.
+DEFER_CASCADE = getattr(settings, 'MONITOR_DEFER_CASCADE', False)
+# A deferred cascade failing this many times is given up, see MonitorJob.
+JOB_ATTEMPTS = getattr(settings, 'MONITOR_JOB_ATTEMPTS', 5)
+
+# Collectors of the measurements of moderation operations (dotted paths or
+# callables), see ``django_monitor.instrument``. None by default.
+COLLECTORS = getattr(settings, 'MONITOR_COLLECTORS', ())
+
+# Upper bounds (in seconds) of the buckets of the time-to-decision histogram.
+LATENCY_BUCKETS = getattr(
+    settings, 'MONITOR_LATENCY_BUCKETS',
+    (60, 300, 900, 3600, 4 * 3600, 12 * 3600, 86400, 3 * 86400, 7 * 86400)
+)
+
+# Objects waiting longer than this many seconds are past the SLA, see
+# ``MonitorEntry.objects.age_stats``.
+SLA = getattr(settings, 'MONITOR_SLA', 86400)
+# Ages (in seconds) at which the queue is bucketed to estimate percentiles on
+# databases without percentile functions.
+AGE_BUCKETS = getattr(settings, 'MONITOR_AGE_BUCKETS', LATENCY_BUCKETS)
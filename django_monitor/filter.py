@@ -1,44 +1,75 @@
-from django.contrib.admin.filters import ChoicesFieldListFilter
-from django.utils.encoding import smart_unicode
+from copy import copy
+
+from django.contrib.admin import SimpleListFilter
 from django.utils.translation import ugettext_lazy as _
-from django_monitor.conf import STATUS_DICT
-
-
-class MonitorFilter(ChoicesFieldListFilter):
-    """A custom list-filter to enable filtering by monitor-status."""
-
-    def __init__(self, field, request, params, model, model_admin,
-                 field_path=None):
-        """Extended to set lookup_kwarg & lookup_val."""
-        self.lookup_kwarg = 'status'
-        # usually, lookup_vals are extracted from request.GET. But we have
-        # intentionally removed ``status`` from GET before.  (Have a look at
-        # ``django_monitor.admin.MonitorAdmin.queryset`` to know why). So we'll
-        # apply regex over the url:
-        import re
-        status_matches = re.findall(
-            r'status=(?P<status>%s)' % '|'.join(STATUS_DICT.keys()),
-            request.get_full_path()
+from django_monitor.conf import (
+    STATUS_DICT, PENDING_STATUS, CHALLENGED_STATUS, APPROVED_STATUS
+)
+
+
+class MonitorFilter(SimpleListFilter):
+    """
+    A list-filter to filter objects by monitor-status. Each status shows the
+    number of objects in it, counted with one grouped query over the
+    changelist queryset (searched & filtered by all but this filter).
+    """
+    title = _("Moderation status")
+    parameter_name = 'status'
+
+    def __init__(self, request, params, model, model_admin):
+        self.request = request
+        super(MonitorFilter, self).__init__(
+            request, params, model, model_admin
         )
-        self.lookup_val = status_matches[0] if status_matches else None
-        self.lookup_choices = STATUS_DICT.keys()
-        super(MonitorFilter, self).__init__(field, request, params, model,
-                                            model_admin, field_path)
-        self.title = _("Moderation status")
 
-    def expected_parameters(self):
-        """Return the list of expected parameters."""
-        return [self.lookup_kwarg]
+    def lookups(self, request, model_admin):
+        return [
+            (status, STATUS_DICT[status]) for status in
+            (PENDING_STATUS, CHALLENGED_STATUS, APPROVED_STATUS)
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() in STATUS_DICT and hasattr(queryset, '_by_status'):
+            return queryset._by_status(self.value())
+        return queryset
+
+    def get_counts(self, cl):
+        """
+        Objects per status in the changelist, as it would be without this
+        filter. Cached on the request, so the changelist is counted once
+        however many times the filter is displayed.
+        """
+        cache = self.request.__dict__.setdefault('_monitor_status_counts', {})
+        if cl.model not in cache:
+            if self.parameter_name in cl.params:
+                # The changelist with all else, but not this filter, applied.
+                unfiltered = copy(cl)
+                unfiltered.params = dict(cl.params)
+                del unfiltered.params[self.parameter_name]
+                queryset = unfiltered.get_queryset(self.request)
+            else:
+                queryset = cl.queryset
+            if hasattr(queryset, 'status_counts'):
+                cache[cl.model] = queryset.status_counts()
+            else:
+                # Not a MonitoredObjectQuerySet.
+                cache[cl.model] = {}
+        return cache[cl.model]
 
     def choices(self, cl):
+        counts = self.get_counts(cl)
         yield {
-            'selected': self.lookup_val is None,
-            'query_string': cl.get_query_string({}, [self.lookup_kwarg]),
+            'selected': self.value() is None,
+            'query_string': cl.get_query_string({}, [self.parameter_name]),
             'display': _('All')
         }
-        for val in self.lookup_choices:
+        for status, title in self.lookup_choices:
+            if status in counts:
+                title = '%s (%d)' % (title, counts[status])
             yield {
-            'selected': smart_unicode(val) == self.lookup_val,
-            'query_string': cl.get_query_string({self.lookup_kwarg: val}),
-            'display': STATUS_DICT[val]
-        }
+                'selected': self.value() == status,
+                'query_string': cl.get_query_string(
+                    {self.parameter_name: status}, []
+                ),
+                'display': title
+            }
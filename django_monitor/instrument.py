@@ -0,0 +1,179 @@
+"""
+Instrumentation of the moderation operations. Each measured operation
+records the SQL queries it ran, the time it took and the objects it touched,
+and hands them to the collectors given in ``MONITOR_COLLECTORS``: ::
+
+    MONITOR_COLLECTORS = [
+        'django_monitor.instrument.log_collector',
+        'django_monitor.instrument.stats',
+    ]
+
+Without collectors, measured operations run as they are.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import threading
+from timeit import default_timer
+
+from django.dispatch import Signal
+
+logger = logging.getLogger('django_monitor.instrument')
+
+# Sent by ``signal_collector`` for each operation measured.
+operation_measured = Signal(
+    providing_args = ["operation", "queries", "seconds", "objects"]
+)
+
+# Loaded from settings on first use, see ``get_collectors``.
+_collectors = None
+
+
+class Measurement(object):
+    """ What one run of an operation cost."""
+    __slots__ = ('operation', 'queries', 'seconds', 'objects')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.queries = 0
+        self.seconds = 0.0
+        self.objects = 0
+
+    def __repr__(self):
+        return '<Measurement %s: %d queries, %.3fs, %d objects>' % (
+            self.operation, self.queries, self.seconds, self.objects
+        )
+
+
+def get_collectors():
+    """ The collectors given in ``MONITOR_COLLECTORS``, imported once."""
+    global _collectors
+    if _collectors is None:
+        from django.utils.module_loading import import_string
+        from django_monitor.conf import COLLECTORS
+        _collectors = [
+            path if callable(path) else import_string(path)
+            for path in COLLECTORS
+        ]
+    return _collectors
+
+
+def set_collectors(collectors):
+    """
+    Replaces the collectors, eg. in tests. Returns the previous ones. Pass
+    None to load them from settings again.
+    """
+    global _collectors
+    previous = _collectors
+    _collectors = None if collectors is None else list(collectors)
+    return previous
+
+
+@contextmanager
+def measure(operation, using = None):
+    """
+    Measures the block as one run of ``operation`` and hands the
+    Measurement to the collectors. Set ``objects`` on the yielded
+    Measurement to the number of objects touched. Yields None, and measures
+    nothing, when there are no collectors.
+    """
+    collectors = get_collectors()
+    if not collectors:
+        yield None
+        return
+    from django.db import DEFAULT_DB_ALIAS, connections
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    measurement = Measurement(operation)
+    # Queries are counted in the log the debug cursor keeps.
+    force_debug_cursor = connection.force_debug_cursor
+    connection.force_debug_cursor = True
+    queries = len(connection.queries_log)
+    start = default_timer()
+    try:
+        yield measurement
+    finally:
+        measurement.seconds = default_timer() - start
+        measurement.queries = len(connection.queries_log) - queries
+        connection.force_debug_cursor = force_debug_cursor
+        for collector in collectors:
+            try:
+                collector(measurement)
+            except Exception:
+                logger.exception('Collector %r failed.', collector)
+
+
+def measured(operation, objects = None):
+    """
+    Decorator to measure each call of the function as ``operation``.
+    ``objects`` computes the number of objects touched from the result; each
+    call touches one object by default.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Checked before anything else, so that it costs next to nothing
+            # without collectors.
+            if _collectors is not None and not _collectors:
+                return func(*args, **kwargs)
+            with measure(operation) as measurement:
+                result = func(*args, **kwargs)
+                if measurement is not None:
+                    measurement.objects = (
+                        objects(result) if objects is not None else 1
+                    )
+            return result
+        return wrapper
+    return decorator
+
+
+def signal_collector(measurement):
+    """ Sends ``operation_measured``."""
+    operation_measured.send(
+        sender = None, operation = measurement.operation,
+        queries = measurement.queries, seconds = measurement.seconds,
+        objects = measurement.objects
+    )
+
+
+def log_collector(measurement):
+    """ Logs to the ``django_monitor.instrument`` logger."""
+    logger.info(
+        '%s: %d queries, %.1f ms, %d objects', measurement.operation,
+        measurement.queries, measurement.seconds * 1000, measurement.objects
+    )
+
+
+class StatsRegistry(object):
+    """
+    Collector that sums up calls, queries, time and objects per operation,
+    in the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, measurement):
+        with self._lock:
+            stats = self._stats.setdefault(measurement.operation, {
+                'calls': 0, 'queries': 0, 'seconds': 0.0, 'objects': 0
+            })
+            stats['calls'] += 1
+            stats['queries'] += measurement.queries
+            stats['seconds'] += measurement.seconds
+            stats['objects'] += measurement.objects
+
+    def snapshot(self):
+        """ A copy of the stats, keyed by operation."""
+        with self._lock:
+            return dict(
+                (operation, dict(stats))
+                for operation, stats in self._stats.items()
+            )
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+# The stats registry to use in MONITOR_COLLECTORS.
+stats = StatsRegistry()
@@ -0,0 +1,128 @@
+from datetime import datetime
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from django_monitor import get_monitor_meta, queued_models
+from django_monitor.conf import STATUS_DICT, PENDING_STATUS
+from django_monitor.models import MonitorEntry, MonitorCounter, MonitorEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the missing monitor entries for objects that existed before "
+        "their model was enqueued for moderation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs = '*', metavar = 'app_label.ModelName',
+            help = 'Models to backfill. Defaults to all enqueued models.'
+        )
+        parser.add_argument(
+            '--status', default = PENDING_STATUS,
+            choices = sorted(STATUS_DICT.keys()),
+            help = 'Status of the entries created. Defaults to %s.' % (
+                PENDING_STATUS
+            )
+        )
+        parser.add_argument(
+            '--batch-size', type = int, default = 1000,
+            help = 'Number of objects checked & backfilled at a time.'
+        )
+        parser.add_argument(
+            '--start-after', type = int, default = None,
+            help = 'Resume after this pk. Works with a single model only.'
+        )
+        parser.add_argument(
+            '--database', default = 'default',
+            help = 'The database to backfill the entries in.'
+        )
+
+    def handle(self, *args, **options):
+        self.using = options['database']
+        self.status = options['status']
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        if self.batch_size < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        if options['models']:
+            models = []
+            for label in options['models']:
+                try:
+                    models.append(apps.get_model(label))
+                except (ValueError, LookupError):
+                    raise CommandError('Unknown model: %s' % label)
+        else:
+            models = list(queued_models())
+        if options['start_after'] is not None and len(models) != 1:
+            raise CommandError('--start-after needs exactly one model.')
+
+        total = 0
+        for model in models:
+            if not get_monitor_meta(model):
+                raise CommandError(
+                    '%s is not enqueued for moderation.' %
+                    model._meta.label
+                )
+            total += self.backfill(model, options['start_after'])
+        if self.verbosity >= 1:
+            self.stdout.write("Created %d monitor entries." % total)
+
+    def backfill(self, model, start_after = None):
+        """
+        Walks the pks of the model in ascending order, a batch at a time,
+        and creates the entries missing in each batch. Objects are never
+        loaded. Each batch is committed on its own, so an interrupted run
+        can be resumed from the last pk reported.
+        """
+        meta = get_monitor_meta(model)
+        label = model._meta.label
+        pks = model._base_manager.using(self.using).order_by(
+            'pk'
+        ).values_list('pk', flat = True)
+        created = 0
+        last_pk = start_after
+        while True:
+            batch_pks = pks
+            if last_pk is not None:
+                batch_pks = batch_pks.filter(pk__gt = last_pk)
+            batch = list(batch_pks[:self.batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            existing = set(MonitorEntry.objects.using(self.using).filter(
+                content_type = meta.content_type_id, object_id__in = batch
+            ).values_list('object_id', flat = True))
+            missing = [pk for pk in batch if pk not in existing]
+            if missing:
+                now = datetime.now()
+                with transaction.atomic(using = self.using):
+                    MonitorEntry.objects.using(self.using).bulk_create([
+                        MonitorEntry(
+                            content_type_id = meta.content_type_id,
+                            object_id = pk, status = self.status,
+                            status_date = now, timestamp = now
+                        )
+                        for pk in missing
+                    ])
+                    MonitorCounter.objects.db_manager(self.using).change(
+                        meta.content_type_id, self.status, len(missing)
+                    )
+                    MonitorEvent.objects.db_manager(self.using).record(
+                        meta.content_type_id,
+                        [(pk, None) for pk in missing], self.status,
+                        timestamp = now
+                    )
+                created += len(missing)
+            if self.verbosity >= 2:
+                self.stdout.write(
+                    "%s: %d entries created, up to pk %s." % (
+                        label, created, last_pk
+                    )
+                )
+        if self.verbosity >= 1:
+            self.stdout.write("%s: %d entries created." % (label, created))
+        return created
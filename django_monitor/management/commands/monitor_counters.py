@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from django_monitor.models import MonitorCounter
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the moderation counters from the monitor entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default = 'default',
+            help = 'The database to rebuild the counters in.'
+        )
+
+    def handle(self, *args, **options):
+        counters = MonitorCounter.objects.db_manager(options['database'])
+        counters.rebuild()
+        if options['verbosity'] >= 1:
+            self.stdout.write(
+                "Rebuilt %d moderation counters." % counters.count()
+            )
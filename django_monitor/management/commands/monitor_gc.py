@@ -0,0 +1,125 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from django_monitor.models import MonitorEntry, MonitorCounter
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes monitor entries whose objects do not exist any more, eg. "
+        "objects deleted by raw SQL or in cascade from unmonitored models."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs = '*', metavar = 'app_label.ModelName',
+            help = 'Restricts the collection to the entries of these models.'
+        )
+        parser.add_argument(
+            '--batch-size', type = int, default = 1000,
+            help = 'Number of entries checked & deleted at a time.'
+        )
+        parser.add_argument(
+            '--dry-run', action = 'store_true', default = False,
+            help = 'Only report the orphaned entries, do not delete them.'
+        )
+        parser.add_argument(
+            '--database', default = 'default',
+            help = 'The database to collect the entries from.'
+        )
+
+    def handle(self, *args, **options):
+        self.using = options['database']
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        if self.batch_size < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        entries = MonitorEntry.objects.using(self.using)
+        if options['models']:
+            content_types = []
+            for label in options['models']:
+                try:
+                    app_label, model_name = label.split('.')
+                    content_types.append(
+                        ContentType.objects.db_manager(
+                            self.using
+                        ).get_by_natural_key(app_label, model_name.lower())
+                    )
+                except (ValueError, ContentType.DoesNotExist):
+                    raise CommandError('Unknown model: %s' % label)
+        else:
+            content_types = ContentType.objects.db_manager(
+                self.using
+            ).filter(pk__in = entries.values('content_type').distinct())
+
+        total = 0
+        for ct in content_types:
+            total += self.collect(ct)
+        if self.verbosity >= 1:
+            self.stdout.write("%s %d orphaned monitor entries." % (
+                'Found' if self.dry_run else 'Deleted', total
+            ))
+
+    def collect(self, ct):
+        """
+        Walks the entries of the content type in batches of ascending ids
+        and removes those without an object. Only one batch is held in
+        memory at a time.
+        """
+        model = ct.model_class()
+        label = '%s.%s' % (ct.app_label, ct.model)
+        entries = MonitorEntry.objects.using(self.using).filter(
+            content_type = ct
+        ).order_by('id')
+        scanned = orphaned = 0
+        last_id = 0
+        while True:
+            batch = list(entries.filter(id__gt = last_id).values_list(
+                'id', 'object_id', 'status'
+            )[:self.batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            scanned += len(batch)
+            if model is None:
+                # The model itself is gone.
+                existing = set()
+            else:
+                existing = set(
+                    model._base_manager.using(self.using).filter(
+                        pk__in = [object_id for _, object_id, _ in batch]
+                    ).values_list('pk', flat = True)
+                )
+            orphans = [
+                (entry_id, status) for entry_id, object_id, status in batch
+                if object_id not in existing
+            ]
+            orphaned += len(orphans)
+            if orphans and not self.dry_run:
+                self.delete(ct, orphans)
+            if self.verbosity >= 2:
+                self.stdout.write("%s: scanned %d, orphaned %d" % (
+                    label, scanned, orphaned
+                ))
+        if self.verbosity >= 1 and orphaned:
+            self.stdout.write("%s: %d of %d entries orphaned." % (
+                label, orphaned, scanned
+            ))
+        return orphaned
+
+    def delete(self, ct, orphans):
+        """ Deletes the (entry_id, status) given & moves the counters."""
+        by_status = {}
+        for entry_id, status in orphans:
+            by_status.setdefault(status, []).append(entry_id)
+        with transaction.atomic(using = self.using):
+            for status, entry_ids in by_status.items():
+                num = MonitorEntry.objects.using(self.using).filter(
+                    id__in = entry_ids, status = status
+                ).delete()[0]
+                MonitorCounter.objects.db_manager(self.using).transition(
+                    ct.id, status, None, num
+                )
@@ -0,0 +1,101 @@
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from django_monitor.conf import JOB_ATTEMPTS
+from django_monitor.models import MonitorJob
+
+
+def run_job(job):
+    """ Runs the job in a pool thread, which has its own connections."""
+    try:
+        return job.run()
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the deferred cascades of moderation (MonitorJob), a batch at "
+        "a time, until there are none left. Failed jobs are run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type = int, default = 10,
+            help = 'Number of jobs taken at a time.'
+        )
+        parser.add_argument(
+            '--threads', type = int, default = 1,
+            help = 'Number of jobs run side by side.'
+        )
+        parser.add_argument(
+            '--stale', type = int, default = 3600,
+            help = (
+                'Seconds after which a started job is taken to be abandoned '
+                'and run again.'
+            )
+        )
+        parser.add_argument(
+            '--attempts', type = int, default = JOB_ATTEMPTS,
+            help = (
+                'Number of times a failing job is run before giving up '
+                '(MONITOR_JOB_ATTEMPTS).'
+            )
+        )
+        parser.add_argument(
+            '--forever', action = 'store_true', default = False,
+            help = 'Keep waiting for new jobs instead of exiting.'
+        )
+        parser.add_argument(
+            '--sleep', type = float, default = 5,
+            help = 'Seconds to wait between polls with --forever.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        threads = options['threads']
+        if batch_size < 1 or threads < 1 or options['attempts'] < 1:
+            raise CommandError(
+                '--batch-size, --threads and --attempts must be positive '
+                'numbers.'
+            )
+        stale = timedelta(seconds = options['stale'])
+        pool = ThreadPool(threads) if threads > 1 else None
+        done = failed = 0
+        try:
+            while True:
+                jobs = MonitorJob.objects.claim(
+                    batch_size, stale, options['attempts']
+                )
+                if not jobs:
+                    if not options['forever']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                if pool is None:
+                    for job in jobs:
+                        job.run()
+                else:
+                    pool.map(run_job, jobs)
+                for job in jobs:
+                    done += 1
+                    if job.finished is None:
+                        failed += 1
+                        self.stderr.write(
+                            "Job %d failed (attempt %d):\n%s" % (
+                                job.id, job.attempts, job.error
+                            )
+                        )
+                if options['verbosity'] >= 2:
+                    self.stdout.write("%d jobs run." % done)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if options['verbosity'] >= 1:
+            self.stdout.write("Ran %d jobs, %d failed." % (done, failed))
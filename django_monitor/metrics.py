@@ -0,0 +1,100 @@
+"""
+Metrics of the moderation queues in the Prometheus text format. Everything
+is read from the counter tables (MonitorCounter & MonitorLatency), never
+from the entries, so scraping costs two small queries.
+"""
+from django.contrib.contenttypes.models import ContentType
+
+from django_monitor.conf import (
+    PENDING_STATUS, CHALLENGED_STATUS, APPROVED_STATUS
+)
+from django_monitor.models import MonitorCounter, MonitorLatency
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STATUS_LABELS = {
+    PENDING_STATUS: 'pending',
+    CHALLENGED_STATUS: 'challenged',
+    APPROVED_STATUS: 'approved',
+}
+
+
+def _labels(model, status, **extra):
+    labels = [('model', model), ('status', STATUS_LABELS[status])]
+    labels.extend(sorted(extra.items()))
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+def _model_label(ct_id):
+    ct = ContentType.objects.get_for_id(ct_id)
+    return '%s.%s' % (ct.app_label, ct.model)
+
+
+def render_metrics():
+    """ Returns the metrics as a string."""
+    lines = []
+    counters = sorted(
+        (_model_label(ct_id), status, count, decisions)
+        for ct_id, status, count, decisions in MonitorCounter.objects.values_list(
+            'content_type', 'status', 'count', 'decisions'
+        )
+        if status in STATUS_LABELS
+    )
+
+    lines.append(
+        '# HELP django_monitor_objects Moderated objects per model and status.'
+    )
+    lines.append('# TYPE django_monitor_objects gauge')
+    for model, status, count, decisions in counters:
+        lines.append('django_monitor_objects%s %d' % (
+            _labels(model, status), count
+        ))
+
+    lines.append(
+        '# HELP django_monitor_decisions_total Moderations of objects to '
+        'each status.'
+    )
+    lines.append('# TYPE django_monitor_decisions_total counter')
+    for model, status, count, decisions in counters:
+        lines.append('django_monitor_decisions_total%s %d' % (
+            _labels(model, status), decisions
+        ))
+
+    # Buckets are stored per range; Prometheus wants them cumulative.
+    histograms = {}
+    for ct_id, status, le, count, seconds in MonitorLatency.objects.values_list(
+        'content_type', 'status', 'le', 'count', 'seconds'
+    ):
+        if status not in STATUS_LABELS:
+            continue
+        histogram = histograms.setdefault((_model_label(ct_id), status), {})
+        histogram[le] = (count, seconds)
+    lines.append(
+        '# HELP django_monitor_decision_seconds Time from the creation of '
+        'objects to their moderation.'
+    )
+    lines.append('# TYPE django_monitor_decision_seconds histogram')
+    for (model, status), histogram in sorted(histograms.items()):
+        cumulative, total = 0, 0.0
+        for le in sorted(le for le in histogram if le):
+            cumulative += histogram[le][0]
+            total += histogram[le][1]
+            lines.append('django_monitor_decision_seconds_bucket%s %d' % (
+                _labels(model, status, le = str(le)), cumulative
+            ))
+        overflow = histogram.get(0, (0, 0.0))
+        cumulative += overflow[0]
+        total += overflow[1]
+        lines.append('django_monitor_decision_seconds_bucket%s %d' % (
+            _labels(model, status, le = '+Inf'), cumulative
+        ))
+        lines.append('django_monitor_decision_seconds_sum%s %s' % (
+            _labels(model, status), repr(float(total))
+        ))
+        lines.append('django_monitor_decision_seconds_count%s %d' % (
+            _labels(model, status), cumulative
+        ))
+    return '\n'.join(lines) + '\n'
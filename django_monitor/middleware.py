@@ -1,15 +1,104 @@
+from contextlib import contextmanager
+import sys
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python < 3.7
+    ContextVar = None
 try:
     from threading import local
 except ImportError:
     from django.utils._threading_local import local
 
-_thread_locals = local()
+# The acting user follows the task (asyncio, contextvars aware executors)
+# where contextvars are available, and the thread otherwise.
+if ContextVar is not None:
+    _current_user = ContextVar('monitor_user', default = None)
+else:
+    _thread_locals = local()
 
 
 def get_current_user():
+    if ContextVar is not None:
+        return _current_user.get()
     return getattr(_thread_locals, 'monitor_user', None)
 
 
+def set_current_user(user):
+    """
+    Makes ``user`` the acting user. Returns a token to be given to
+    ``reset_current_user`` to restore the previous one.
+    """
+    if ContextVar is not None:
+        return _current_user.set(user)
+    token = getattr(_thread_locals, 'monitor_user', None)
+    _thread_locals.monitor_user = user
+    return token
+
+
+def reset_current_user(token):
+    """ Restores the acting user from before ``set_current_user``."""
+    if ContextVar is not None:
+        _current_user.reset(token)
+    else:
+        _thread_locals.monitor_user = token
+
+
+@contextmanager
+def acting_user(user):
+    """
+    Objects created & moderated within this block are auto-moderated for
+    ``user``, eg. in management commands, workers and batch jobs: ::
+
+        with acting_user(moderator):
+            Book.objects.create(...)
+    """
+    token = set_current_user(user)
+    try:
+        yield user
+    finally:
+        reset_current_user(token)
+
+
 class MonitorMiddleware(object):
+    """
+    Makes ``request.user`` the acting user while the request is handled.
+    Works both as new style (sync or async) and old style middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response = None):
+        self.get_response = get_response
+        self.is_async = False
+        if get_response is not None and sys.version_info[0] >= 3:
+            try:
+                from django_monitor.aio import mark_async_middleware
+            except ImportError:
+                # No asgiref, no async either.
+                pass
+            else:
+                self.is_async = mark_async_middleware(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            from django_monitor.aio import call_async_middleware
+            return call_async_middleware(self, request)
+        token = set_current_user(getattr(request, 'user', None))
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_user(token)
+
+    # Old style (MIDDLEWARE_CLASSES)
+
     def process_request(self, request):
-        _thread_locals.monitor_user = getattr(request, 'user', None)
+        request._monitor_user_token = set_current_user(
+            getattr(request, 'user', None)
+        )
+
+    def process_response(self, request, response):
+        if hasattr(request, '_monitor_user_token'):
+            reset_current_user(request._monitor_user_token)
+            del request._monitor_user_token
+        return response
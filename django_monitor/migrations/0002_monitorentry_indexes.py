@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_entries(apps, schema_editor):
+    """
+    Older releases could create more than one entry for the same object.
+    Keep the latest of those so that the unique constraint can be applied.
+    """
+    MonitorEntry = apps.get_model('django_monitor', 'MonitorEntry')
+    duplicates = MonitorEntry.objects.values(
+        'content_type', 'object_id'
+    ).annotate(
+        num_entries = Count('id'), latest_id = Max('id')
+    ).filter(num_entries__gt = 1)
+    for dup in duplicates.iterator():
+        MonitorEntry.objects.filter(
+            content_type = dup['content_type'], object_id = dup['object_id']
+        ).exclude(id = dup['latest_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_monitor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_entries, migrations.RunPython.noop
+        ),
+        migrations.AlterUniqueTogether(
+            name='monitorentry',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='monitorentry',
+            index_together=set([('content_type', 'status', 'timestamp')]),
+        ),
+    ]
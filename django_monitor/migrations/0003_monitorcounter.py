@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_entries(apps, schema_editor):
+    """ Build the counters for the entries already there."""
+    MonitorEntry = apps.get_model('django_monitor', 'MonitorEntry')
+    MonitorCounter = apps.get_model('django_monitor', 'MonitorCounter')
+    grouped = MonitorEntry.objects.values_list(
+        'content_type', 'status'
+    ).annotate(count = models.Count('id')).order_by()
+    MonitorCounter.objects.bulk_create([
+        MonitorCounter(content_type_id = ct_id, status = status, count = count)
+        for ct_id, status, count in grouped
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_monitor', '0002_monitorentry_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonitorCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[(b'IP', b'In Pending'), (b'CH', b'Challenged'), (b'AP', b'Approved')], max_length=2)),
+                ('count', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='monitorcounter',
+            unique_together=set([('content_type', 'status')]),
+        ),
+        migrations.RunPython(count_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_monitor', '0003_monitorcounter'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='monitorentry',
+            index_together=set([
+                ('content_type', 'status', 'timestamp'),
+                ('status', 'timestamp', 'id'),
+            ]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_monitor', '0005_monitorentry_claims'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonitorEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, b'In Pending'), (2, b'Challenged'), (3, b'Approved')])),
+                ('old_status', models.PositiveSmallIntegerField(blank=True, choices=[(1, b'In Pending'), (2, b'Challenged'), (3, b'Approved')], null=True)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('notes', models.CharField(blank=True, max_length=100)),
+                ('content_type', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='monitorevent',
+            index_together=set([('content_type', 'object_id', 'timestamp')]),
+        ),
+    ]
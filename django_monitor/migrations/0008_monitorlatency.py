@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_monitor', '0007_monitorjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monitorcounter',
+            name='decisions',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MonitorLatency',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[(b'IP', b'In Pending'), (b'CH', b'Challenged'), (b'AP', b'Approved')], max_length=2)),
+                ('le', models.PositiveIntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('seconds', models.FloatField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='monitorlatency',
+            unique_together=set([('content_type', 'status', 'le')]),
+        ),
+    ]
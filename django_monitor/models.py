@@ -1,14 +1,43 @@
-from django.db import models
+from collections import namedtuple
+from django.db import IntegrityError, connections, models, transaction
 from django.contrib.contenttypes.fields import GenericForeignKey
 import datetime
+import sys
 
-from . import model_from_queue
+from django_monitor.instrument import measured
 from django_monitor.conf import (
-    STATUS_DICT, PENDING_STATUS, APPROVED_STATUS, CHALLENGED_STATUS
+    STATUS_DICT, PENDING_STATUS, APPROVED_STATUS, CHALLENGED_STATUS,
+    JOB_ATTEMPTS
 )
 STATUS_CHOICES = STATUS_DICT.items()
 
 
+# Age of the objects waiting in a queue, see ``MonitorEntryManager.age_stats``.
+QueueAge = namedtuple(
+    'QueueAge', ['count', 'oldest', 'percentiles', 'over_sla', 'exact']
+)
+
+
+def estimate_age(count, oldest, older, percentile):
+    """
+    Estimates the age (in seconds) ``percentile`` of ``count`` objects are
+    younger than, from ``older``: a list of (age, number of objects older
+    than that) per bucket. Interpolates linearly within the bucket.
+    """
+    points = [(0, count)]
+    points.extend(sorted(
+        (age, num) for age, num in older if 0 < age < oldest
+    ))
+    points.append((oldest, 0))
+    target = (1 - percentile) * count
+    for (low, low_num), (high, high_num) in zip(points, points[1:]):
+        if low_num >= target >= high_num and low_num > high_num:
+            return low + (high - low) * (
+                float(low_num - target) / (low_num - high_num)
+            )
+    return oldest
+
+
 class MonitorEntryManager(models.Manager):
     """ Custom Manager for MonitorEntry"""
 
@@ -21,6 +50,204 @@ class MonitorEntryManager(models.Manager):
         except MonitorEntry.DoesNotExist:
             pass
 
+    def queue(self, status = (PENDING_STATUS, CHALLENGED_STATUS),
+              content_types = None, after = None, limit = 50):
+        """
+        The oldest entries in the given status(es) across all models, oldest
+        first. Pages are fetched by keyset on (timestamp, id): pass the last
+        entry of a page (or its ``queue_cursor``) as ``after`` to get the
+        next one. No page costs more than reading ``limit`` index entries.
+        """
+        if not isinstance(status, (list, tuple, set, frozenset)):
+            status = [status]
+        qset = self.filter(
+            status__in = list(status), timestamp__isnull = False
+        )
+        if content_types is not None:
+            qset = qset.filter(content_type__in = content_types)
+        if after is not None:
+            if isinstance(after, MonitorEntry):
+                after = after.queue_cursor
+            timestamp, entry_id = after
+            qset = qset.filter(
+                models.Q(timestamp__gt = timestamp) |
+                models.Q(timestamp = timestamp, id__gt = entry_id)
+            )
+        return qset.select_related('content_type', 'status_by').order_by(
+            'timestamp', 'id'
+        )[:limit]
+
+    def claim(self, user, limit = 10, status = PENDING_STATUS,
+              content_types = None, lease = None):
+        """
+        Hands out up to ``limit`` of the oldest entries in ``status`` that
+        nobody else holds, to ``user``, for ``lease`` (a timedelta, 15
+        minutes by default). Entries whose lease has expired return to the
+        queue. Concurrent moderators get different entries: rows are locked
+        with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+        supports it, otherwise taken with a conditional UPDATE.
+        Returns the claimed entries, oldest first.
+        """
+        now = datetime.datetime.now()
+        claimed_until = now + (lease or datetime.timedelta(minutes = 15))
+        claimable = self.filter(
+            models.Q(claimed_until__isnull = True) |
+            models.Q(claimed_until__lt = now) |
+            models.Q(claimed_by = user),
+            status = status, timestamp__isnull = False
+        )
+        if content_types is not None:
+            claimable = claimable.filter(content_type__in = content_types)
+        claimable = claimable.order_by('timestamp', 'id')
+        features = connections[self.db].features
+
+        with transaction.atomic(using = self.db):
+            if getattr(features, 'has_select_for_update_skip_locked', False):
+                ids = list(claimable.select_for_update(
+                    skip_locked = True
+                ).values_list('id', flat = True)[:limit])
+                self.filter(id__in = ids).update(
+                    claimed_by = user, claimed_until = claimed_until
+                )
+            else:
+                # The conditional UPDATE takes only the candidates nobody
+                # has claimed in the meantime.
+                ids = list(claimable.values_list('id', flat = True)[:limit])
+                claimable.filter(id__in = ids).update(
+                    claimed_by = user, claimed_until = claimed_until
+                )
+                ids = list(self.filter(
+                    id__in = ids, claimed_by = user,
+                    claimed_until = claimed_until
+                ).values_list('id', flat = True))
+        return list(
+            self.filter(id__in = ids).select_related('content_type').order_by(
+                'timestamp', 'id'
+            )
+        )
+
+    def age_stats(self, status = PENDING_STATUS, content_types = None,
+                  percentiles = (0.5, 0.95), sla = None, now = None):
+        """
+        How long objects have been waiting in ``status``, per model, worked
+        out in the database. Returns a dict of ``QueueAge`` keyed by content
+        type id, with the number of objects, the age of the oldest one, the
+        ages given ``percentiles`` of them are younger than, and the number
+        waiting longer than ``sla`` (a timedelta; ``MONITOR_SLA`` seconds by
+        default). Ages are timedeltas.
+
+        On PostgreSQL the percentiles are exact (``percentile_disc``). Other
+        databases count the objects per bucket of ``MONITOR_AGE_BUCKETS`` in
+        the same query as the rest, and the percentiles are interpolated;
+        ``exact`` is False then.
+        """
+        from django_monitor.conf import AGE_BUCKETS, SLA
+        now = now or datetime.datetime.now()
+        if sla is None:
+            sla = datetime.timedelta(seconds = SLA)
+        qset = self.filter(status = status, timestamp__isnull = False)
+        if content_types is not None:
+            content_types = [getattr(ct, 'id', ct) for ct in content_types]
+            qset = qset.filter(content_type__in = content_types)
+
+        def count_older(age):
+            return models.Sum(models.Case(
+                models.When(timestamp__lt = now - age, then = models.Value(1)),
+                default = models.Value(0), output_field = models.IntegerField()
+            ))
+        aggregates = {
+            'count': models.Count('id'),
+            'oldest': models.Min('timestamp'),
+            'over_sla': count_older(sla),
+        }
+        exact = connections[self.db].vendor == 'postgresql'
+        if not exact:
+            for bucket in AGE_BUCKETS:
+                aggregates['older_%d' % bucket] = count_older(
+                    datetime.timedelta(seconds = bucket)
+                )
+        grouped = qset.order_by().values('content_type').annotate(
+            **aggregates
+        )
+        if exact:
+            exact_ages = self._percentile_ages(
+                status, content_types, percentiles, now
+            )
+
+        stats = {}
+        for row in grouped:
+            ct_id = row['content_type']
+            oldest = now - row['oldest']
+            if exact:
+                ages = exact_ages.get(ct_id, {})
+            else:
+                seconds = oldest.total_seconds()
+                older = [
+                    (bucket, row['older_%d' % bucket] or 0)
+                    for bucket in AGE_BUCKETS
+                ]
+                ages = dict(
+                    (percentile, datetime.timedelta(seconds = estimate_age(
+                        row['count'], seconds, older, percentile
+                    )))
+                    for percentile in percentiles
+                )
+            stats[ct_id] = QueueAge(
+                row['count'], oldest, ages, row['over_sla'] or 0, exact
+            )
+        return stats
+
+    def _percentile_ages(self, status, content_types, percentiles, now):
+        """
+        Exact percentile ages on PostgreSQL, with one query walking the
+        (content_type, status, timestamp) index. The ``percentile`` of ages
+        is the ``1 - percentile`` of timestamps.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        sql = (
+            'SELECT %(ct)s, percentile_disc(%%s::float8[]) '
+            'WITHIN GROUP (ORDER BY %(timestamp)s) FROM %(table)s '
+            'WHERE %(status)s = %%s AND %(timestamp)s IS NOT NULL'
+        ) % {
+            'ct': qn(opts.get_field('content_type').column),
+            'timestamp': qn(opts.get_field('timestamp').column),
+            'status': qn(opts.get_field('status').column),
+            'table': qn(opts.db_table),
+        }
+        params = [[1 - percentile for percentile in percentiles], status]
+        if content_types is not None:
+            if not content_types:
+                return {}
+            sql += ' AND %s IN (%s)' % (
+                qn(opts.get_field('content_type').column),
+                ', '.join(['%s'] * len(content_types))
+            )
+            params.extend(content_types)
+        sql += ' GROUP BY %s' % qn(opts.get_field('content_type').column)
+        ages = {}
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for ct_id, timestamps in cursor.fetchall():
+                ages[ct_id] = dict(
+                    (percentile, now - timestamp)
+                    for percentile, timestamp in zip(percentiles, timestamps)
+                )
+        return ages
+
+    def release(self, user, entries = None):
+        """
+        Returns the entries claimed by ``user`` to the queue. All of them,
+        if ``entries`` (entries or their ids) is not given.
+        """
+        claimed = self.filter(claimed_by = user)
+        if entries is not None:
+            claimed = claimed.filter(id__in = [
+                getattr(me, 'id', me) for me in entries
+            ])
+        return claimed.update(claimed_by = None, claimed_until = None)
+
 
 class MonitorEntry(models.Model):
     """ Each Entry will monitor the status of one moderated model object"""
@@ -33,6 +260,12 @@ class MonitorEntry(models.Model):
     status_by = models.ForeignKey('auth.User', blank = True, null = True)
     status_date = models.DateTimeField(blank = True, null = True)
     notes = models.CharField(max_length = 100, blank = True)
+    # A moderator working on the object holds it until the lease expires.
+    claimed_by = models.ForeignKey(
+        'auth.User', blank = True, null = True, related_name = '+',
+        on_delete = models.SET_NULL
+    )
+    claimed_until = models.DateTimeField(blank = True, null = True)
 
     content_type = models.ForeignKey('contenttypes.ContentType')
     object_id = models.PositiveIntegerField()
@@ -42,26 +275,86 @@ class MonitorEntry(models.Model):
         app_label = 'django_monitor'
         verbose_name = 'moderation Queue'
         verbose_name_plural = 'moderation Queue'
+        # Every lookup goes through (content_type, object_id) and the queue
+        # summaries filter by (content_type, status). The cross-model queue
+        # pages through (status, timestamp, id).
+        unique_together = (('content_type', 'object_id'),)
+        index_together = (
+            ('content_type', 'status', 'timestamp'),
+            ('status', 'timestamp', 'id'),
+        )
+
+    def __init__(self, *args, **kwargs):
+        super(MonitorEntry, self).__init__(*args, **kwargs)
+        # The status as saved in db. Used to maintain the MonitorCounter.
+        # Read from __dict__ so that a deferred status is not loaded here.
+        self._saved_status = self.__dict__.get('status') if self.pk else None
 
     def __unicode__(self):
         return "[%s] %s" % (self.get_status_display(), self.content_object)
 
+    def save(self, *args, **kwargs):
+        """
+        Extended to keep MonitorCounter in sync with the status. Within an
+        atomic block already, no savepoint of its own is opened.
+        """
+        old_status = None if self._state.adding else self._saved_status
+        using = kwargs.get('using')
+        with transaction.atomic(using = using, savepoint = False):
+            super(MonitorEntry, self).save(*args, **kwargs)
+            if old_status != self.status:
+                MonitorCounter.objects.db_manager(using).transition(
+                    self.content_type_id, old_status, self.status
+                )
+        self._saved_status = self.status
+
+    def delete(self, *args, **kwargs):
+        """ Extended to keep MonitorCounter in sync with the status."""
+        with transaction.atomic(using = kwargs.get('using')):
+            result = super(MonitorEntry, self).delete(*args, **kwargs)
+            MonitorCounter.objects.transition(
+                self.content_type_id, self._saved_status, None
+            )
+        return result
+
+    @property
+    def queue_cursor(self):
+        """ Position of the entry in ``MonitorEntry.objects.queue``."""
+        return (self.timestamp, self.id)
+
     def get_absolute_url(self):
         if hasattr(self.content_object, "get_absolute_url"):
             return self.content_object.get_absolute_url()
 
+    @measured('moderate')
     def _moderate(self, status, user, notes = ''):
         from django_monitor import post_moderation
+        old_status = self._saved_status
         self.status = status
         self.status_by = user
         self.status_date = datetime.datetime.now()
         self.notes = notes
-        self.save()
+        # Moderated. The claim, if any, is over.
+        self.claimed_by = None
+        self.claimed_until = None
+        with transaction.atomic():
+            self.save()
+            MonitorEvent.objects.record(
+                self.content_type_id, [(self.object_id, old_status)], status,
+                user, notes, self.status_date
+            )
+            if old_status is not None:
+                MonitorCounter.objects.decide(
+                    self.content_type_id, status, [self.timestamp],
+                    self.status_date
+                )
         # post_moderation signal will be generated now with the associated
         # object as the ``instance`` and its model as the ``sender``.
+        # Do not fetch the object if nobody is listening.
         sender_model = self.content_type.model_class()
-        instance = self.content_object
-        post_moderation.send(sender = sender_model, instance = instance)
+        if post_moderation.has_listeners(sender_model):
+            instance = self.content_object
+            post_moderation.send(sender = sender_model, instance = instance)
 
     def approve(self, user = None, notes = ''):
         """Deprecated. Approve the object"""
@@ -96,32 +389,597 @@ class MonitorEntry(models.Model):
         return self.status == CHALLENGED_STATUS
 
 
+class MonitorCounterManager(models.Manager):
+    """ Custom Manager for MonitorCounter"""
+
+    def change(self, content_type_id, status, delta, decisions = 0):
+        """
+        Add ``delta`` to the counter of given content_type & status, and
+        ``decisions`` to its number of moderations.
+        """
+        if not delta and not decisions:
+            return
+        counters = self.filter(content_type = content_type_id, status = status)
+        changes = {
+            'count': models.F('count') + delta,
+            'decisions': models.F('decisions') + decisions,
+        }
+        if counters.update(**changes):
+            return
+        try:
+            with transaction.atomic(using = self.db):
+                self.create(
+                    content_type_id = content_type_id, status = status,
+                    count = delta, decisions = decisions
+                )
+        except IntegrityError:
+            # Somebody else has just created it.
+            counters.update(**changes)
+
+    def decide(self, content_type_id, status, timestamps, decided_at):
+        """
+        Counts the moderation to ``status``, at ``decided_at``, of entries
+        created at ``timestamps``. Their time to decision goes to
+        MonitorLatency, unless they are just reset to pending.
+        """
+        if not timestamps:
+            return
+        self.change(content_type_id, status, 0, len(timestamps))
+        if status != PENDING_STATUS:
+            MonitorLatency.objects.db_manager(self.db).observe(
+                content_type_id, status, [
+                    max((decided_at - timestamp).total_seconds(), 0)
+                    for timestamp in timestamps if timestamp is not None
+                ]
+            )
+
+    def transition(self, content_type_id, old_status, new_status, num = 1):
+        """
+        Move ``num`` objects from ``old_status`` to ``new_status``. Either of
+        them may be None, for objects entering or leaving moderation.
+        """
+        if old_status == new_status:
+            return
+        if old_status is not None:
+            self.change(content_type_id, old_status, -num)
+        if new_status is not None:
+            self.change(content_type_id, new_status, num)
+
+    def counts(self, content_types = None, statuses = None):
+        """
+        Returns a dict of object counts keyed by (content_type_id, status).
+        ``content_types`` & ``statuses`` optionally restrict the result.
+        """
+        qset = self.all()
+        if content_types is not None:
+            qset = qset.filter(content_type__in = content_types)
+        if statuses is not None:
+            qset = qset.filter(status__in = statuses)
+        return dict(
+            ((ct_id, status), count) for ct_id, status, count in
+            qset.values_list('content_type', 'status', 'count')
+        )
+
+    def rebuild(self):
+        """
+        Recount all objects from MonitorEntry, from scratch. The numbers of
+        decisions can not be recounted and are kept as they are.
+        """
+        with transaction.atomic(using = self.db):
+            decisions = dict(
+                ((ct_id, status), num) for ct_id, status, num in
+                self.values_list('content_type', 'status', 'decisions')
+            )
+            self.all().delete()
+            grouped = MonitorEntry.objects.using(self.db).values_list(
+                'content_type', 'status'
+            ).annotate(count = models.Count('id')).order_by()
+            counters = []
+            for ct_id, status, count in grouped:
+                counters.append(MonitorCounter(
+                    content_type_id = ct_id, status = status, count = count,
+                    decisions = decisions.pop((ct_id, status), 0)
+                ))
+            counters.extend(
+                MonitorCounter(
+                    content_type_id = ct_id, status = status, count = 0,
+                    decisions = num
+                )
+                for (ct_id, status), num in decisions.items() if num
+            )
+            self.bulk_create(counters)
+
+
+class MonitorCounter(models.Model):
+    """
+    Number of monitored objects per model and status. Maintained along with
+    every change in MonitorEntry, so that queue depths are read without
+    counting the entries.
+    """
+    objects = MonitorCounterManager()
+
+    content_type = models.ForeignKey('contenttypes.ContentType')
+    status = models.CharField(max_length = 2, choices = STATUS_CHOICES)
+    count = models.IntegerField(default = 0)
+    # Number of moderations to this status, ever.
+    decisions = models.BigIntegerField(default = 0)
+
+    class Meta:
+        app_label = 'django_monitor'
+        unique_together = (('content_type', 'status'),)
+
+    def __unicode__(self):
+        return "%s [%s]: %s" % (
+            self.content_type, self.get_status_display(), self.count
+        )
+
+
+class MonitorLatencyManager(models.Manager):
+    """ Custom Manager for MonitorLatency"""
+
+    def observe(self, content_type_id, status, durations):
+        """
+        Adds the given times to decision (in seconds) of objects moderated
+        to ``status`` to the histogram, one UPDATE per bucket hit.
+        """
+        from django_monitor.conf import LATENCY_BUCKETS
+        buckets = sorted(LATENCY_BUCKETS)
+        grouped = {}
+        for seconds in durations:
+            # 0 stands for +Inf.
+            le = next((bound for bound in buckets if seconds <= bound), 0)
+            num, total = grouped.get(le, (0, 0.0))
+            grouped[le] = (num + 1, total + seconds)
+        for le, (num, total) in grouped.items():
+            rows = self.filter(
+                content_type = content_type_id, status = status, le = le
+            )
+            changes = {
+                'count': models.F('count') + num,
+                'seconds': models.F('seconds') + total,
+            }
+            if rows.update(**changes):
+                continue
+            try:
+                with transaction.atomic(using = self.db):
+                    self.create(
+                        content_type_id = content_type_id, status = status,
+                        le = le, count = num, seconds = total
+                    )
+            except IntegrityError:
+                # Somebody else has just created it.
+                rows.update(**changes)
+
+
+class MonitorLatency(models.Model):
+    """
+    Histogram of the time from the creation of objects to their moderation,
+    per model and status moderated to. Each row counts the decisions that
+    took at most ``le`` seconds (and more than the bucket below); ``le`` 0
+    stands for longer than all buckets.
+    """
+    objects = MonitorLatencyManager()
+
+    content_type = models.ForeignKey('contenttypes.ContentType')
+    status = models.CharField(max_length = 2, choices = STATUS_CHOICES)
+    le = models.PositiveIntegerField()
+    count = models.BigIntegerField(default = 0)
+    # Sum of the times in the bucket.
+    seconds = models.FloatField(default = 0)
+
+    class Meta:
+        app_label = 'django_monitor'
+        unique_together = (('content_type', 'status', 'le'),)
+
+
+class MonitorEventManager(models.Manager):
+    """ Custom Manager for MonitorEvent"""
+
+    def record(self, content_type_id, objects, status, user = None,
+               notes = '', timestamp = None):
+        """
+        Appends one event per ``(object_id, old_status)`` pair in
+        ``objects``, all moderated to ``status`` by ``user``, with a single
+        bulk insert. ``old_status`` is None for objects entering moderation.
+        Does nothing if ``MONITOR_HISTORY`` is switched off.
+        """
+        from django_monitor.conf import CHUNK_SIZE, HISTORY
+        if not HISTORY or not objects:
+            return
+        timestamp = timestamp or datetime.datetime.now()
+        code = MonitorEvent.STATUS_CODES[status]
+        user_id = getattr(user, 'pk', None)
+        self.bulk_create([
+            MonitorEvent(
+                content_type_id = content_type_id, object_id = object_id,
+                status = code,
+                old_status = MonitorEvent.STATUS_CODES.get(old_status),
+                user_id = user_id, timestamp = timestamp, notes = notes
+            )
+            for object_id, old_status in objects
+        ], batch_size = CHUNK_SIZE)
+
+    def for_instance(self, obj):
+        """ Moderation history of ``obj``, oldest first."""
+        from django.contrib.contenttypes.models import ContentType
+        ct = ContentType.objects.get_for_model(obj.__class__)
+        return self.filter(content_type = ct, object_id = obj.pk).order_by(
+            'timestamp', 'id'
+        )
+
+
+class MonitorEvent(models.Model):
+    """
+    Append-only history of moderation decisions. Rows are never updated, and
+    deliberately not linked to MonitorEntry, so that auditing does not touch
+    the entry table and outlives the entries.
+    """
+    # Statuses are stored as small integers.
+    STATUS_CODES = {
+        PENDING_STATUS: 1,
+        CHALLENGED_STATUS: 2,
+        APPROVED_STATUS: 3,
+    }
+    CODE_CHOICES = sorted(
+        (code, STATUS_DICT[status]) for status, code in STATUS_CODES.items()
+    )
+
+    objects = MonitorEventManager()
+
+    content_type = models.ForeignKey(
+        'contenttypes.ContentType', related_name = '+', db_index = False
+    )
+    object_id = models.PositiveIntegerField()
+    status = models.PositiveSmallIntegerField(choices = CODE_CHOICES)
+    old_status = models.PositiveSmallIntegerField(
+        choices = CODE_CHOICES, blank = True, null = True
+    )
+    user = models.ForeignKey(
+        'auth.User', blank = True, null = True, related_name = '+',
+        db_index = False, on_delete = models.SET_NULL
+    )
+    timestamp = models.DateTimeField(db_index = True)
+    notes = models.CharField(max_length = 100, blank = True)
+
+    class Meta:
+        app_label = 'django_monitor'
+        index_together = (('content_type', 'object_id', 'timestamp'),)
+
+    def __unicode__(self):
+        return "%s:%s %s" % (
+            self.content_type_id, self.object_id, self.get_status_display()
+        )
+
+    @property
+    def monitor_status(self):
+        """ The status as used by MonitorEntry, ie. 'IP', 'CH' or 'AP'."""
+        for status, code in self.STATUS_CODES.items():
+            if code == self.status:
+                return status
+
+
+class MonitorJobManager(models.Manager):
+    """ Custom Manager for MonitorJob"""
+
+    def enqueue(self, model, pks, status, user = None):
+        """
+        Records the cascade of moderating the ``model`` objects with the
+        given pks to ``status``, one job per chunk of pks. Returns the jobs.
+        """
+        from django_monitor import get_monitor_meta
+        from django_monitor.util import chunked
+        ct_id = get_monitor_meta(model).content_type_id
+        now = datetime.datetime.now()
+        jobs = [
+            MonitorJob(
+                content_type_id = ct_id, status = status, user = user,
+                object_ids = ','.join(str(pk) for pk in chunk),
+                created = now
+            )
+            for chunk in chunked(pks)
+        ]
+        self.bulk_create(jobs)
+        return jobs
+
+    def unfinished(self, content_types = None, attempts = JOB_ATTEMPTS):
+        """
+        Jobs waiting to be run or still running, ie. not failed ``attempts``
+        times already (None for no limit).
+        """
+        qset = self.filter(finished__isnull = True)
+        if attempts is not None:
+            qset = qset.filter(attempts__lt = attempts)
+        if content_types is not None:
+            qset = qset.filter(content_type__in = content_types)
+        return qset
+
+    def failed(self, content_types = None, attempts = JOB_ATTEMPTS):
+        """ Jobs given up on, after failing ``attempts`` times."""
+        qset = self.filter(
+            finished__isnull = True, attempts__gte = attempts
+        )
+        if content_types is not None:
+            qset = qset.filter(content_type__in = content_types)
+        return qset
+
+    def claim(self, limit = 10, stale = None, attempts = None):
+        """
+        Marks up to ``limit`` of the oldest waiting jobs as started and
+        returns them. Jobs started longer than ``stale`` (a timedelta) ago
+        are taken to be abandoned by a dead worker and handed out again.
+        Jobs that failed ``attempts`` times already are left alone.
+        Workers running side by side never get the same job: a job is taken
+        with a conditional UPDATE that fails if someone else has taken it.
+        """
+        now = datetime.datetime.now()
+        claimable = models.Q(started__isnull = True)
+        if stale is not None:
+            claimable |= models.Q(started__lt = now - stale)
+        waiting = self.unfinished(attempts = attempts).filter(claimable)
+        ids = list(
+            waiting.order_by('id').values_list('id', flat = True)[:limit]
+        )
+        waiting.filter(id__in = ids).update(started = now)
+        return list(
+            self.filter(id__in = ids, started = now).select_related(
+                'content_type', 'user'
+            ).order_by('id')
+        )
+
+
+class MonitorJob(models.Model):
+    """
+    A deferred cascade: moderating the objects related to the given objects
+    (see ``rel_fields``), to be run by ``manage.py monitor_jobs``.
+    """
+    objects = MonitorJobManager()
+
+    content_type = models.ForeignKey('contenttypes.ContentType')
+    # Comma separated pks of the objects moderated.
+    object_ids = models.TextField()
+    status = models.CharField(max_length = 2, choices = STATUS_CHOICES)
+    user = models.ForeignKey(
+        'auth.User', blank = True, null = True, related_name = '+',
+        on_delete = models.SET_NULL
+    )
+    created = models.DateTimeField()
+    started = models.DateTimeField(blank = True, null = True)
+    finished = models.DateTimeField(blank = True, null = True)
+    count = models.IntegerField(default = 0)
+    # Number of runs so far, and the traceback of the last failed one.
+    attempts = models.PositiveSmallIntegerField(default = 0)
+    error = models.TextField(blank = True)
+
+    class Meta:
+        app_label = 'django_monitor'
+        index_together = (('finished', 'started'),)
+
+    def __unicode__(self):
+        return "%s -> %s (%s)" % (
+            self.content_type, self.get_status_display(), self.created
+        )
+
+    @property
+    def pks(self):
+        return [int(pk) for pk in self.object_ids.split(',') if pk]
+
+    def run(self):
+        """
+        Moderates the related objects in one transaction and marks the job
+        finished. If it fails, the cascade is rolled back, the traceback is
+        kept in ``error`` and the job is left waiting to be run again.
+        Returns the number of related objects moderated.
+        """
+        import traceback
+        from django.db import transaction
+        from django_monitor.util import cascade_rel_objects
+        model = self.content_type.model_class()
+        self.attempts += 1
+        try:
+            with transaction.atomic():
+                self.count = cascade_rel_objects(
+                    model, self.pks, self.status, self.user
+                )
+        except Exception:
+            self.error = traceback.format_exc()
+            self.started = None
+        else:
+            self.error = ''
+            self.finished = datetime.datetime.now()
+        self.save(update_fields = [
+            'count', 'attempts', 'error', 'started', 'finished'
+        ])
+        return self.count
+
+
 class MonitoredObjectQuerySet(models.QuerySet):
     """ Chainable queryset for checking status """
 
-    def _by_status(self, field_name, status):
-        """ Filter queryset by given status"""
-        where_clause = '%s = %%s' % (field_name)
-        return self.extra(where = [where_clause], params = [status])
+    # Set by ``with_monitor_entries``: None, or whether to load status_by.
+    _monitor_prefetch = None
+
+    def _clone(self, *args, **kwargs):
+        clone = super(MonitoredObjectQuerySet, self)._clone(*args, **kwargs)
+        clone._monitor_prefetch = self._monitor_prefetch
+        return clone
+
+    def _fetch_all(self):
+        """ Extended to attach the monitor entries once results are in."""
+        fetched = self._result_cache is not None
+        super(MonitoredObjectQuerySet, self)._fetch_all()
+        if self._monitor_prefetch is not None and not fetched:
+            from django_monitor.util import prefetch_monitor_entries
+            prefetch_monitor_entries(
+                [obj for obj in self._result_cache
+                    if isinstance(obj, models.Model)],
+                self._monitor_prefetch, self.db
+            )
+
+    def with_monitor_entries(self, select_status_by = False):
+        """
+        Load the monitor entries of all objects with one query when the
+        queryset is evaluated, instead of one query per object. Pass
+        ``select_status_by = True`` to load ``status_by`` users too.
+        """
+        clone = self._clone()
+        clone._monitor_prefetch = select_status_by
+        return clone
+
+    def bulk_create(self, objs, batch_size = None):
+        """
+        Extended to create the monitor entries too, with one more bulk
+        insert. ``post_save`` is not sent by ``bulk_create``, so the objects
+        would never get monitored otherwise. The objects must have their pks
+        set after the insert: either set them explicitly or use a database
+        that returns them (PostgreSQL).
+        """
+        from django_monitor.middleware import get_current_user
+        from django_monitor.util import create_monitor_entries
+
+        with transaction.atomic(using = self.db):
+            objs = super(MonitoredObjectQuerySet, self).bulk_create(
+                list(objs), batch_size = batch_size
+            )
+            if any(obj.pk is None for obj in objs):
+                # Rolls back the insert too.
+                raise ValueError(
+                    "Can not monitor %s objects created without primary "
+                    "keys." % self.model._meta.object_name
+                )
+            create_monitor_entries(
+                self.model, objs, get_current_user(), batch_size, self.db
+            )
+        return objs
+
+    def delete(self):
+        """
+        Extended to remove the monitor entries of all objects deleted, those
+        deleted in cascade too, with bulk DELETEs per content type (in chunks)
+        instead of one lookup & DELETE per object in ``delete_handler``.
+        Mirrors ``QuerySet.delete`` otherwise.
+        """
+        from django.db.models.deletion import Collector
+        from django_monitor import get_monitor_meta
+        from django_monitor.util import bulk_deleting, delete_entries
+
+        assert self.query.can_filter(), \
+            "Cannot use 'limit' or 'offset' with delete."
+
+        if self._fields is not None:
+            raise TypeError(
+                "Cannot call delete() after .values() or .values_list()"
+            )
+
+        del_query = self._clone()
+        del_query._for_write = True
+        del_query.query.select_for_update = False
+        del_query.query.select_related = False
+        del_query.query.clear_ordering(force_empty = True)
+
+        with transaction.atomic(using = del_query.db):
+            collector = Collector(using = del_query.db)
+            collector.collect(del_query)
+            for model, instances in collector.data.items():
+                meta = get_monitor_meta(model)
+                if meta:
+                    delete_entries(
+                        meta.content_type_id, [obj.pk for obj in instances],
+                        del_query.db
+                    )
+            with bulk_deleting():
+                deleted = collector.delete()
+
+        self._result_cache = None
+        return deleted
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def with_status(self):
+        """
+        Select the moderation status of each object as ``_status`` so that
+        ``monitor_status`` needs no further query. Objects without a monitor
+        entry get None.
+        """
+        return self.annotate(
+            _status = models.F('%s__status' % MONITOR_RELATION)
+        )
+
+    def _by_status(self, *statuses):
+        """ Filter queryset by given statuses"""
+        # Reuse the join of ``with_status`` if there is one already.
+        if '_status' in self.query.annotations:
+            lookup = '_status'
+        else:
+            lookup = '%s__status' % MONITOR_RELATION
+        if len(statuses) == 1:
+            return self.filter(**{lookup: statuses[0]})
+        return self.filter(**{'%s__in' % lookup: statuses})
+
+    def status_counts(self):
+        """
+        Number of objects in each status, counted with one grouped query.
+        Returns a dict keyed by status.
+        """
+        if '_status' in self.query.annotations:
+            lookup = '_status'
+        else:
+            lookup = '%s__status' % MONITOR_RELATION
+        counts = dict.fromkeys(STATUS_DICT, 0)
+        counts.update(
+            self.order_by().values_list(lookup).annotate(models.Count('pk'))
+        )
+        return counts
 
     def approved(self):
         """ All approved objects"""
-        return self._by_status('status', APPROVED_STATUS)
+        return self._by_status(APPROVED_STATUS)
 
     def exclude_approved(self):
         """ All not-approved objects"""
-        where_clause = '%s != %%s' % ('status')
-        return self.extra(
-            where = [where_clause], params = [APPROVED_STATUS]
-        )
+        return self._by_status(PENDING_STATUS, CHALLENGED_STATUS)
 
     def pending(self):
         """ All pending objects """
-        return self._by_status('status', PENDING_STATUS)
+        return self._by_status(PENDING_STATUS)
 
     def challenged(self):
         """ All challenged objects """
-        return self._by_status('status', CHALLENGED_STATUS)
+        return self._by_status(CHALLENGED_STATUS)
+
+    def moderate(self, status, user = None, notes = ''):
+        """
+        Moderate all objects in the queryset and their monitored parents.
+        Monitor entries are changed with one UPDATE per content type instead
+        of one save per object. Returns the number of objects moderated.
+        """
+        from django_monitor.util import bulk_moderate, needs_pk_list
+
+        if status not in STATUS_DICT.keys():
+            return 0
+        # The pk subquery reads the monitor table. Some backends (MySQL) can
+        # not update a table selected in a subquery, so fetch the pks first.
+        # We need them anyway if anyone listens to the moderation signals.
+        pks = self.values('pk')
+        if (
+            not connections[self.db].features.update_can_self_select or
+            needs_pk_list(self.model)
+        ):
+            pks = list(self.values_list('pk', flat = True))
+            if not pks:
+                return 0
+        return bulk_moderate(self.model, pks, status, user, notes, self.db)
+
+    def approve(self, user = None, notes = ''):
+        """ Approve all objects in the queryset """
+        return self.moderate(APPROVED_STATUS, user, notes)
+
+    def challenge(self, user = None, notes = ''):
+        """ Challenge all objects in the queryset """
+        return self.moderate(CHALLENGED_STATUS, user, notes)
+
+    def reset_to_pending(self, user = None, notes = ''):
+        """ Reset all objects in the queryset to pending """
+        return self.moderate(PENDING_STATUS, user, notes)
 
 
 class MonitoredObjectManager(models.Manager):
@@ -130,29 +988,15 @@ class MonitoredObjectManager(models.Manager):
     use_for_related_fields = True
 
     def get_queryset(self):
-        from django.contrib.contenttypes.models import ContentType
-
-        # parameters to help with generic SQL
-        db_table = self.model._meta.db_table
-        pk_name = self.model._meta.pk.attname
-        content_type = ContentType.objects.get_for_model(self.model).id
-
-        # extra params - status and id of object (for later access)
-        select = {
-            '_monitor_id': '%s.id' % MONITOR_TABLE,
-            '_status': '%s.status' % MONITOR_TABLE,
-        }
-        where = [
-            '%s.content_type_id=%s' % (MONITOR_TABLE, content_type),
-            '%s.object_id=%s.%s' % (MONITOR_TABLE, db_table, pk_name)
-        ]
-        tables = [MONITOR_TABLE]
+        """
+        The monitor entries are joined through the generic relation added by
+        ``add_fields``, only when the queryset filters, orders on or selects
+        the status.
+        """
+        return MonitoredObjectQuerySet(self.model, using = self._db)
 
-        # build extra query then copy model/query to a MonitoredObjectQuerySet
-        q = super(MonitoredObjectManager, self).get_queryset().extra(
-            select = select, where = where, tables = tables
-        )
-        return MonitoredObjectQuerySet(self.model, q.query)
+    def with_status(self):
+        return self.get_queryset().with_status()
 
     def approved(self):
         return self.get_queryset().approved()
@@ -191,20 +1035,16 @@ class MonitoredObjectMixin():
 
     def moderate(self, status, user = None, notes = ''):
         """ developers may use this to moderate objects """
-        from django.contrib.contenttypes.models import ContentType
+        from django_monitor import get_monitor_meta
 
         getattr(self, 'monitor_entry').moderate(status, user, notes)
         # Auto-Moderate parents also
-        monitored_parents = filter(
-            lambda x: model_from_queue(x),
-            self._meta.parents.keys()
-        )
-        for parent in monitored_parents:
-            parent_ct = ContentType.objects.get_for_model(parent)
-            parent_pk_field = self._meta.get_ancestor_link(parent)
-            parent_pk = getattr(self, parent_pk_field.attname)
+        for parent, parent_ct_id, parent_attname in (
+            get_monitor_meta(self.__class__).parents
+        ):
             me = MonitorEntry.objects.get(
-                content_type = parent_ct, object_id = parent_pk
+                content_type = parent_ct_id,
+                object_id = getattr(self, parent_attname)
             )
             me.moderate(status, user)
 
@@ -234,3 +1074,15 @@ class MonitoredObjectMixin():
 
 
 MONITOR_TABLE = MonitorEntry._meta.db_table
+# Name of the generic relation to MonitorEntry added to moderated models.
+MONITOR_RELATION = 'monitor_entries'
+
+# Async counterparts (amoderate, aapprove, aget_for_instance...) for ASGI.
+if sys.version_info[0] >= 3:
+    try:
+        from django_monitor.aio import contribute_async_api
+    except ImportError:
+        # No asgiref, ie. Django < 3.0.
+        pass
+    else:
+        contribute_async_api()
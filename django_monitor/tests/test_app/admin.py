@@ -8,6 +8,7 @@ from django_monitor.admin import MonitorAdmin
 class AuthorAdmin(MonitorAdmin):
     """ Monitored model. So the admin inherited from MonitorAdmin."""
     list_display = ('__unicode__',)
+    search_fields = ('name',)
 
 class SuppInline(admin.TabularInline):
     model = Supplement
@@ -1,5 +1,7 @@
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from unittest import skipUnless
 
 from django.test import TestCase
 from django.contrib.auth.models import User, Permission
@@ -8,7 +10,7 @@ from django.contrib.contenttypes.models import ContentType
 from django_monitor.conf import (
     PENDING_STATUS, CHALLENGED_STATUS, APPROVED_STATUS
 )
-from django_monitor.models import MonitorEntry
+from django_monitor.models import MonitorEntry, MonitorEvent
 from django_monitor.tests.test_app.models import (
     Author, Book, EBook, Supplement, Publisher, Reader
 )
@@ -400,3 +402,659 @@ class ModTest(TestCase):
         self.assertEquals(queued_reader['pending'], 3)
         self.assertEquals(queued_reader['challenged'], 0)
         self.client.logout()
+
+    def test_8_bulk_moderation(self):
+        """
+        Moderating a queryset updates the monitor entries of all objects and
+        their monitored parents together.
+        """
+        pub1 = Publisher.objects.create(name = 'test_pub', num_awards = 3)
+        eb1 = EBook.objects.create(
+            isbn = '123456789', name = 'ebook1', pages = 300, publisher = pub1
+        )
+        eb2 = EBook.objects.create(
+            isbn = '123456780', name = 'ebook2', pages = 200, publisher = pub1
+        )
+        self.assertEquals(EBook.objects.pending().count(), 2)
+        count = EBook.objects.pending().approve(self.moderator)
+        self.assertEquals(count, 2)
+        self.assertEquals(EBook.objects.approved().count(), 2)
+        self.assertEquals(Book.objects.approved().count(), 2)
+        me = MonitorEntry.objects.get_for_instance(eb1)
+        self.assertEquals(me.status_by, self.moderator)
+        # Only the matching objects are touched.
+        self.assertEquals(EBook.objects.filter(pk = eb2.pk).challenge(), 1)
+        self.assertEquals(EBook.objects.get(pk = eb1.pk).is_approved, True)
+        self.assertEquals(EBook.objects.get(pk = eb2.pk).is_challenged, True)
+
+    def test_9_bulk_moderation_signal(self):
+        """
+        Bulk moderation sends ``post_bulk_moderation`` once per model with
+        the pks of all objects moderated.
+        """
+        import django_monitor
+
+        received = []
+        def handler(sender, pks, status, user, **kwargs):
+            received.append((sender, sorted(pks), status, user))
+
+        django_monitor.post_bulk_moderation.connect(handler, sender = Author)
+        try:
+            auth1 = Author.objects.create(name = 'auth1', age = 34)
+            auth2 = Author.objects.create(name = 'auth2', age = 35)
+            Author.objects.all().approve(self.moderator)
+        finally:
+            django_monitor.post_bulk_moderation.disconnect(
+                handler, sender = Author
+            )
+        self.assertEquals(received, [
+            (Author, [auth1.pk, auth2.pk], APPROVED_STATUS, self.moderator)
+        ])
+
+    def test_10_cascade_moderation(self):
+        """
+        Moderating objects cascades through ``rel_fields`` and each related
+        object is moderated once.
+        """
+        from django_monitor.util import collect_rel_objects, moderate_rel_objects
+
+        pub1 = Publisher.objects.create(name = 'test_pub', num_awards = 3)
+        book1 = Book.objects.create(
+            isbn = '123456789', name = 'book1', pages = 300, publisher = pub1
+        )
+        book2 = Book.objects.create(
+            isbn = '123456780', name = 'book2', pages = 200, publisher = pub1
+        )
+        sup1 = Supplement.objects.create(serial_num = 1, book = book1)
+        sup2 = Supplement.objects.create(serial_num = 2, book = book1)
+        sup3 = Supplement.objects.create(serial_num = 3, book = book2)
+
+        collected = collect_rel_objects(Book, [book1.pk])
+        self.assertEquals(collected[Book], set([book1.pk]))
+        self.assertEquals(collected[Supplement], set([sup1.pk, sup2.pk]))
+
+        count = moderate_rel_objects(
+            Book.objects.filter(pk = book1.pk), APPROVED_STATUS, self.moderator
+        )
+        self.assertEquals(count, 1)
+        self.assertEquals(Book.objects.get(pk = book1.pk).is_approved, True)
+        self.assertEquals(Supplement.objects.approved().count(), 2)
+        self.assertEquals(Supplement.objects.get(pk = sup3.pk).is_pending, True)
+
+    def test_11_prefetch_monitor_entries(self):
+        """ Monitor entries of many objects are loaded in one query."""
+        from django_monitor.util import prefetch_monitor_entries
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        auth1.approve(self.moderator)
+        with self.assertNumQueries(2):
+            authors = list(
+                Author.objects.order_by('pk').with_monitor_entries(
+                    select_status_by = True
+                )
+            )
+            self.assertEquals(authors[0].monitor_entry.status_by, self.moderator)
+            self.assertEquals(authors[1].monitor_entry.status_by, None)
+        authors = list(Author.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            prefetch_monitor_entries(authors)
+            self.assertEquals(authors[0].monitor_entry.status, APPROVED_STATUS)
+            self.assertEquals(authors[1].monitor_entry.status, PENDING_STATUS)
+
+    def test_12_lazy_status_join(self):
+        """
+        Monitor entries are joined only when the status is filtered on or
+        selected.
+        """
+        from django_monitor.models import MONITOR_TABLE
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        self.assertEquals(MONITOR_TABLE in str(Author.objects.all().query), False)
+        self.assertEquals(MONITOR_TABLE in str(Author.objects.pending().query), True)
+        self.assertEquals(Author.objects.pending().count(), 1)
+        auth1 = Author.objects.with_status().pending().get(pk = auth1.pk)
+        self.assertEquals(auth1._status, PENDING_STATUS)
+        self.assertEquals(Author.objects.with_status().approved().count(), 0)
+
+    def test_13_moderation_queue_grouped_count(self):
+        """
+        Models whose admin shows all objects are counted with one grouped
+        query over the monitor entries.
+        """
+        from django_monitor.admin import has_custom_queryset
+        from django.contrib import admin
+
+        self.assertEquals(has_custom_queryset(admin.site._registry[Author]), False)
+        self.assertEquals(has_custom_queryset(admin.site._registry[Reader]), True)
+        Author.objects.create(name = 'auth1', age = 34)
+        Author.objects.create(name = 'auth2', age = 35)
+        Author.objects.create(name = 'auth3', age = 36)
+        Author.objects.filter(name = 'auth3').challenge()
+        logged_in = self.client.login(username = 'adder', password = 'adder')
+        self.assertEquals(logged_in, True)
+        response = self.client.get(
+            '/admin/django_monitor/monitorentry/', follow = True
+        )
+        self.assertEquals(response.status_code, 200)
+        queued_author = filter(
+            lambda x: x['model_name'] == 'author',
+            response.context[-1]['model_list']
+        )[0]
+        self.assertEquals(queued_author['pending'], 2)
+        self.assertEquals(queued_author['challenged'], 1)
+        self.client.logout()
+
+    def test_14_monitor_counters(self):
+        """ MonitorCounter follows every status change of the entries."""
+        from django.core.management import call_command
+        from django_monitor.models import MonitorCounter
+
+        author_ct = ContentType.objects.get_for_model(Author)
+        def counts():
+            return MonitorCounter.objects.counts(content_types = [author_ct.id])
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        self.assertEquals(counts(), {(author_ct.id, PENDING_STATUS): 2})
+        auth1.approve(self.moderator)
+        self.assertEquals(counts()[(author_ct.id, PENDING_STATUS)], 1)
+        self.assertEquals(counts()[(author_ct.id, APPROVED_STATUS)], 1)
+        Author.objects.pending().challenge(self.moderator)
+        self.assertEquals(counts()[(author_ct.id, PENDING_STATUS)], 0)
+        self.assertEquals(counts()[(author_ct.id, CHALLENGED_STATUS)], 1)
+        auth2.delete()
+        self.assertEquals(counts()[(author_ct.id, CHALLENGED_STATUS)], 0)
+        MonitorCounter.objects.all().update(count = 0)
+        call_command('monitor_counters', verbosity = 0)
+        # Statuses with decisions but no objects keep a row, at zero.
+        self.assertEquals(
+            dict((key, count) for key, count in counts().items() if count),
+            {(author_ct.id, APPROVED_STATUS): 1}
+        )
+        self.assertEquals(counts()[(author_ct.id, CHALLENGED_STATUS)], 0)
+
+    def test_15_single_insert_on_create(self):
+        """
+        Creating a moderated object inserts its monitor entry, complete with
+        status, in one query and caches it on the object.
+        """
+        pub1 = Publisher.objects.create(name = 'test_pub', num_awards = 3)
+        book1 = Book.objects.create(
+            isbn = '123456789', name = 'book1', pages = 300, publisher = pub1
+        )
+        me = MonitorEntry.objects.get_for_instance(book1)
+        self.assertEquals(me.status, PENDING_STATUS)
+        self.assertEquals(me.status_date is None, False)
+        self.assertEquals(me.timestamp is None, False)
+        with self.assertNumQueries(0):
+            self.assertEquals(book1.monitor_entry.pk, me.pk)
+
+        Supplement.objects.create(serial_num = 1, book = book1)
+        # The object, a savepoint around the entry & the move of its
+        # counter, and the event.
+        with self.assertNumQueries(6):
+            Supplement.objects.create(serial_num = 2, book = book1)
+        EBook.objects.create(
+            isbn = '123456780', name = 'ebook1', pages = 30, publisher = pub1
+        )
+        # Both objects, and the entries of the ebook & of its book.
+        with self.assertNumQueries(12):
+            EBook.objects.create(
+                isbn = '123456781', name = 'ebook2', pages = 30,
+                publisher = pub1
+            )
+
+    def test_16_bulk_create(self):
+        """ Objects created with bulk_create get their monitor entries too."""
+        Author.objects.bulk_create([
+            Author(pk = 10, name = 'auth10', age = 34),
+            Author(pk = 11, name = 'auth11', age = 35),
+        ])
+        self.assertEquals(Author.objects.pending().count(), 2)
+        self.assertEquals(Author.objects.get(pk = 11).is_pending, True)
+
+    def test_17_monitor_meta(self):
+        """ Moderation metadata is compiled once per enqueued model."""
+        import django_monitor
+
+        meta = django_monitor.get_monitor_meta(EBook)
+        self.assertEquals(meta is django_monitor.get_monitor_meta(EBook), True)
+        self.assertEquals(
+            meta.content_type_id, ContentType.objects.get_for_model(EBook).id
+        )
+        self.assertEquals(meta.perm, 'test_app.moderate_ebook')
+        self.assertEquals(meta.parents, (
+            (Book, ContentType.objects.get_for_model(Book).id, 'book_ptr_id'),
+        ))
+        self.assertEquals(
+            meta.rel_fields, (('supplements', 'supplements', Supplement),)
+        )
+        self.assertEquals(django_monitor.get_monitor_meta(Publisher), None)
+
+    def test_18_bulk_delete(self):
+        """
+        Deleting a queryset removes the monitor entries of all deleted
+        objects, their parents & the objects deleted in cascade.
+        """
+        from django_monitor.models import MonitorCounter
+
+        pub1 = Publisher.objects.create(name = 'test_pub', num_awards = 3)
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        for num in range(3):
+            eb = EBook.objects.create(
+                isbn = '12345678%s' % num, name = 'ebook%s' % num,
+                pages = 300, publisher = pub1
+            )
+            Supplement.objects.create(serial_num = num, book = eb)
+        self.assertEquals(MonitorEntry.objects.count(), 10)
+        EBook.objects.all().delete()
+        # Only the entry of auth1 remains.
+        self.assertEquals(MonitorEntry.objects.count(), 1)
+        self.assertEquals(Supplement.objects.count(), 0)
+        book_ct = ContentType.objects.get_for_model(Book)
+        self.assertEquals(
+            MonitorCounter.objects.counts(content_types = [book_ct.id]),
+            {(book_ct.id, PENDING_STATUS): 0}
+        )
+        # Invalid deletes still fail as in Django.
+        self.assertRaises(TypeError, Author.objects.values('pk').delete)
+        self.assertRaises(AssertionError, Author.objects.all()[:1].delete)
+        self.assertEquals(Author.objects.count(), 1)
+
+    def test_19_monitor_gc(self):
+        """ monitor_gc deletes the entries of objects that are gone."""
+        from django.core.management import call_command
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        # Deleted behind django-monitor's back.
+        Author._base_manager.filter(pk = auth2.pk)._raw_delete('default')
+        self.assertEquals(MonitorEntry.objects.count(), 2)
+        call_command('monitor_gc', dry_run = True, verbosity = 0)
+        self.assertEquals(MonitorEntry.objects.count(), 2)
+        call_command('monitor_gc', batch_size = 1, verbosity = 0)
+        self.assertEquals(MonitorEntry.objects.count(), 1)
+        self.assertEquals(
+            MonitorEntry.objects.get_for_instance(auth1) is None, False
+        )
+
+    def test_20_monitor_backfill(self):
+        """ monitor_backfill creates the missing monitor entries."""
+        from django.core.management import call_command
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        MonitorEntry.objects.get_for_instance(auth2).delete()
+        call_command(
+            'monitor_backfill', 'test_app.Author', status = APPROVED_STATUS,
+            batch_size = 1, verbosity = 0
+        )
+        self.assertEquals(MonitorEntry.objects.count(), 2)
+        self.assertEquals(Author.objects.get(pk = auth1.pk).is_pending, True)
+        self.assertEquals(Author.objects.get(pk = auth2.pk).is_approved, True)
+        # The backfilled entry has its history too.
+        events = MonitorEvent.objects.for_instance(auth2)
+        self.assertEquals(
+            [(ev.old_status, ev.monitor_status) for ev in events],
+            [(None, PENDING_STATUS), (None, APPROVED_STATUS)]
+        )
+
+    def test_21_moderation_queue_pages(self):
+        """ The queue lists the oldest entries first, a page at a time."""
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        auth3 = Author.objects.create(name = 'auth3', age = 36)
+        auth2.approve(self.moderator)
+        page = list(MonitorEntry.objects.queue(limit = 1))
+        self.assertEquals([me.object_id for me in page], [auth1.pk])
+        page = list(MonitorEntry.objects.queue(after = page[-1], limit = 5))
+        self.assertEquals([me.object_id for me in page], [auth3.pk])
+        self.assertEquals(
+            len(MonitorEntry.objects.queue(status = APPROVED_STATUS)), 1
+        )
+
+        logged_in = self.client.login(username = 'moder', password = 'moder')
+        self.assertEquals(logged_in, True)
+        response = self.client.get(
+            '/admin/django_monitor/monitorentry/queue/?limit=1'
+        )
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.context['rows']), 1)
+        self.assertEquals(response.context['next_url'] is None, False)
+        # Out of range page sizes are clamped.
+        for limit in ('0', '-1', 'x'):
+            response = self.client.get(
+                '/admin/django_monitor/monitorentry/queue/?limit=%s' % limit
+            )
+            self.assertEquals(response.status_code, 200)
+        self.client.logout()
+
+    def test_22_claims(self):
+        """ Claimed entries are not handed out to other moderators."""
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        claimed = MonitorEntry.objects.claim(self.moderator, limit = 1)
+        self.assertEquals([me.object_id for me in claimed], [auth1.pk])
+        claimed = MonitorEntry.objects.claim(self.adder, limit = 5)
+        self.assertEquals([me.object_id for me in claimed], [auth2.pk])
+        self.assertEquals(MonitorEntry.objects.claim(self.adder), claimed)
+
+        # Expired leases go back to the queue.
+        MonitorEntry.objects.filter(claimed_by = self.moderator).update(
+            claimed_until = datetime.now() - timedelta(1)
+        )
+        claimed = MonitorEntry.objects.claim(self.adder, limit = 5)
+        self.assertEquals(len(claimed), 2)
+        self.assertEquals(MonitorEntry.objects.release(self.adder), 2)
+        self.assertEquals(
+            len(MonitorEntry.objects.claim(self.moderator, limit = 5)), 2
+        )
+
+        # Moderation ends the claim.
+        auth1.approve(self.moderator)
+        Author.objects.filter(pk = auth2.pk).approve(self.moderator)
+        self.assertEquals(
+            MonitorEntry.objects.filter(claimed_by__isnull = False).count(), 0
+        )
+
+        # Deleting a moderator leaves what they claimed in moderation.
+        auth1.reset_to_pending(self.moderator)
+        claimer = User.objects.create_user(
+            username = 'claimer', email = 'claimer@monitor.com',
+            password = 'claimer'
+        )
+        MonitorEntry.objects.claim(claimer, limit = 5)
+        claimer.delete()
+        self.assertEquals(
+            MonitorEntry.objects.get_for_instance(auth1).claimed_by, None
+        )
+
+    def test_23_history(self):
+        """ Single, bulk & cascade moderations are all recorded."""
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        self.assertEquals(MonitorEvent.objects.count(), 2)
+        auth1.challenge(self.moderator, 'no')
+        Author.objects.all().approve(self.moderator)
+        events = list(MonitorEvent.objects.for_instance(auth1))
+        self.assertEquals(
+            [(ev.old_status, ev.monitor_status) for ev in events], [
+                (None, PENDING_STATUS),
+                (MonitorEvent.STATUS_CODES[PENDING_STATUS], CHALLENGED_STATUS),
+                (MonitorEvent.STATUS_CODES[CHALLENGED_STATUS], APPROVED_STATUS),
+            ]
+        )
+        self.assertEquals(events[1].notes, 'no')
+        self.assertEquals(events[2].user_id, self.moderator.pk)
+        self.assertEquals(MonitorEvent.objects.for_instance(auth2).count(), 2)
+        # The history outlives the entries.
+        auth2.delete()
+        self.assertEquals(MonitorEvent.objects.count(), 5)
+
+    def test_24_deferred_cascade(self):
+        """ Deferred cascades are left to monitor_jobs."""
+        from django.core.management import call_command
+        from django_monitor.models import MonitorJob
+        from django_monitor.util import moderate_rel_objects
+
+        pub1 = Publisher.objects.create(name = 'test_pub', num_awards = 3)
+        book1 = Book.objects.create(
+            isbn = '123456789', name = 'book1', pages = 300, publisher = pub1
+        )
+        Supplement.objects.create(serial_num = 1, book = book1)
+        Supplement.objects.create(serial_num = 2, book = book1)
+
+        count = moderate_rel_objects(
+            Book.objects.filter(pk = book1.pk), APPROVED_STATUS,
+            self.moderator, defer = True
+        )
+        self.assertEquals(count, 1)
+        self.assertEquals(Book.objects.get(pk = book1.pk).is_approved, True)
+        self.assertEquals(Supplement.objects.approved().count(), 0)
+        self.assertEquals(MonitorJob.objects.unfinished().count(), 1)
+
+        call_command('monitor_jobs', verbosity = 0)
+        self.assertEquals(Supplement.objects.approved().count(), 2)
+        self.assertEquals(MonitorJob.objects.unfinished().count(), 0)
+        job = MonitorJob.objects.get()
+        self.assertEquals((job.count, job.error), (2, ''))
+
+        # Failed jobs are rolled back and run again.
+        from django_monitor import util
+        book1.reset_to_pending(self.moderator)
+        Supplement.objects.all().reset_to_pending(self.moderator)
+        MonitorJob.objects.enqueue(
+            Book, [book1.pk], APPROVED_STATUS, self.moderator
+        )
+        cascade_rel_objects = util.cascade_rel_objects
+        def failing_cascade(*args, **kwargs):
+            cascade_rel_objects(*args, **kwargs)
+            raise ValueError('failed')
+        util.cascade_rel_objects = failing_cascade
+        try:
+            for attempt in range(3):
+                for job in MonitorJob.objects.claim(attempts = 2):
+                    job.run()
+        finally:
+            util.cascade_rel_objects = cascade_rel_objects
+        job = MonitorJob.objects.failed(attempts = 2).get()
+        self.assertEquals((job.attempts, job.finished), (2, None))
+        self.assertEquals('ValueError' in job.error, True)
+        self.assertEquals(MonitorJob.objects.unfinished(attempts = 2).count(), 0)
+        self.assertEquals(Supplement.objects.approved().count(), 0)
+
+        # The changelist tells the jobs in progress from the failed ones.
+        from django.contrib import admin, messages
+        from django_monitor.conf import JOB_ATTEMPTS
+        book_admin = admin.site._registry[Book]
+        book_admin.defer_cascade = True
+        self.client.login(username = 'moder', password = 'moder')
+        try:
+            response = self.client.get('/admin/test_app/book/')
+            levels = [msg.level for msg in response.context['messages']]
+            self.assertEquals(levels, [messages.WARNING])
+            MonitorJob.objects.update(attempts = JOB_ATTEMPTS)
+            response = self.client.get('/admin/test_app/book/')
+            levels = [msg.level for msg in response.context['messages']]
+            self.assertEquals(levels, [messages.ERROR])
+        finally:
+            del book_admin.defer_cascade
+            self.client.logout()
+
+        MonitorJob.objects.update(attempts = 0)
+        call_command('monitor_jobs', verbosity = 0)
+        self.assertEquals(Supplement.objects.approved().count(), 2)
+        self.assertEquals(MonitorJob.objects.unfinished().count(), 0)
+        self.assertEquals(MonitorJob.objects.failed().count(), 0)
+
+    @skipUnless(hasattr(Author, 'aapprove'), 'Needs Python 3 & asgiref.')
+    def test_25_async_api(self):
+        """ The async counterparts moderate & read just like the others."""
+        from asgiref.sync import async_to_sync
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        me = async_to_sync(MonitorEntry.objects.aget_for_instance)(auth1)
+        self.assertEquals(me.status, PENDING_STATUS)
+        async_to_sync(auth1.aapprove)(self.moderator)
+        self.assertEquals(Author.objects.get(pk = auth1.pk).is_approved, True)
+        self.assertEquals(
+            async_to_sync(Author.objects.pending().acount)(), 1
+        )
+        count = async_to_sync(Author.objects.pending().achallenge)(
+            self.moderator
+        )
+        self.assertEquals(count, 1)
+        self.assertEquals(Author.objects.get(pk = auth2.pk).is_challenged, True)
+        entries = async_to_sync(MonitorEntry.objects.aqueue)()
+        self.assertEquals([e.object_id for e in entries], [auth2.pk])
+
+    def test_26_acting_user(self):
+        """ acting_user auto-moderates for the given user, then resets."""
+        from django_monitor.middleware import acting_user, get_current_user
+
+        with acting_user(self.moderator):
+            auth1 = Author.objects.create(name = 'auth1', age = 34)
+            with acting_user(self.adder):
+                auth2 = Author.objects.create(name = 'auth2', age = 35)
+            self.assertEquals(get_current_user(), self.moderator)
+        self.assertEquals(get_current_user(), None)
+        self.assertEquals(Author.objects.get(pk = auth1.pk).is_approved, True)
+        self.assertEquals(Author.objects.get(pk = auth2.pk).is_pending, True)
+
+    def test_27_status_filter_counts(self):
+        """ The status filter shows the number of objects in each status."""
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        Author.objects.create(name = 'auth2', age = 35)
+        Author.objects.create(name = 'auth3', age = 36)
+        auth1.approve(self.moderator)
+        self.assertEquals(
+            Author.objects.all().status_counts(),
+            {PENDING_STATUS: 2, CHALLENGED_STATUS: 0, APPROVED_STATUS: 1}
+        )
+
+        logged_in = self.client.login(username = 'moder', password = 'moder')
+        self.assertEquals(logged_in, True)
+        response = self.client.get(
+            '/admin/test_app/author/?status=%s' % PENDING_STATUS
+        )
+        self.assertEquals(response.status_code, 200)
+        cl = response.context['cl']
+        self.assertEquals(cl.result_count, 2)
+        self.assertContains(response, 'Approved (1)')
+        self.assertContains(response, 'In Pending (2)')
+
+        # The counts are of the objects searched for, whatever the status.
+        Author.objects.create(name = 'other', age = 37)
+        for status in ('', PENDING_STATUS, APPROVED_STATUS):
+            response = self.client.get(
+                '/admin/test_app/author/?q=auth&status=%s' % status
+            )
+            self.assertContains(response, 'Approved (1)')
+            self.assertContains(response, 'In Pending (2)')
+            self.assertContains(response, 'Challenged (0)')
+        self.client.logout()
+
+    def test_28_instrumentation(self):
+        """ Collectors get the queries, time & objects of each operation."""
+        import django_monitor
+        from django_monitor import instrument
+        from django_monitor.tests.test_app.models import (
+            auth_moderation_handler
+        )
+
+        # The handler saves the author again, which would be measured too.
+        django_monitor.post_moderation.disconnect(
+            auth_moderation_handler, sender = Author
+        )
+        registry = instrument.StatsRegistry()
+        previous = instrument.set_collectors([registry])
+        try:
+            auth1 = Author.objects.create(name = 'auth1', age = 34)
+            Author.objects.create(name = 'auth2', age = 35)
+            auth1.approve(self.moderator)
+            Author.objects.pending().approve(self.moderator)
+        finally:
+            instrument.set_collectors(previous)
+            django_monitor.post_moderation.connect(
+                auth_moderation_handler, sender = Author
+            )
+        stats = registry.snapshot()
+        self.assertEquals(stats['save_handler']['calls'], 2)
+        self.assertEquals(stats['save_handler']['queries'] > 0, True)
+        self.assertEquals(stats['moderate']['calls'], 1)
+        self.assertEquals(stats['bulk_moderate']['objects'], 1)
+
+        # Nothing is collected without collectors.
+        instrument.set_collectors([])
+        try:
+            Author.objects.create(name = 'auth3', age = 36)
+        finally:
+            instrument.set_collectors(previous)
+        self.assertEquals(registry.snapshot(), stats)
+
+    def test_29_metrics(self):
+        """ Metrics are served from the counters, in Prometheus format."""
+        from django.test import RequestFactory
+        from django_monitor.models import MonitorCounter, MonitorLatency
+        from django_monitor.views import metrics
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        Author.objects.create(name = 'auth2', age = 35)
+        Author.objects.create(name = 'auth3', age = 36)
+        auth1.approve(self.moderator)
+        Author.objects.pending().challenge(self.moderator)
+        author_ct = ContentType.objects.get_for_model(Author)
+        counts = dict(MonitorCounter.objects.filter(
+            content_type = author_ct
+        ).values_list('status', 'decisions'))
+        self.assertEquals(counts[APPROVED_STATUS], 1)
+        self.assertEquals(counts[CHALLENGED_STATUS], 2)
+        self.assertEquals(
+            MonitorLatency.objects.filter(content_type = author_ct).count(), 2
+        )
+
+        response = metrics(RequestFactory().get('/metrics'))
+        self.assertEquals(response.status_code, 200)
+        body = response.content.decode('utf-8')
+        self.assertEquals(
+            'django_monitor_objects{model="test_app.author",'
+            'status="challenged"} 2' in body, True
+        )
+        self.assertEquals(
+            'django_monitor_decisions_total{model="test_app.author",'
+            'status="approved"} 1' in body, True
+        )
+        self.assertEquals(
+            'django_monitor_decision_seconds_bucket{model="test_app.author",'
+            'status="challenged",le="+Inf"} 2' in body, True
+        )
+
+    def test_30_queue_age_stats(self):
+        """ Ages of the queue are worked out per model, in the database."""
+        from django_monitor.models import estimate_age
+
+        auth1 = Author.objects.create(name = 'auth1', age = 34)
+        auth2 = Author.objects.create(name = 'auth2', age = 35)
+        Author.objects.create(name = 'auth3', age = 36)
+        now = datetime.now()
+        MonitorEntry.objects.filter(object_id = auth1.pk).update(
+            timestamp = now - timedelta(days = 3)
+        )
+        MonitorEntry.objects.filter(object_id = auth2.pk).update(
+            timestamp = now - timedelta(hours = 2)
+        )
+        author_ct = ContentType.objects.get_for_model(Author)
+        stats = MonitorEntry.objects.age_stats(
+            content_types = [author_ct], sla = timedelta(days = 1), now = now
+        )
+        age = stats[author_ct.id]
+        self.assertEquals(age.count, 3)
+        self.assertEquals(age.oldest, timedelta(days = 3))
+        self.assertEquals(age.over_sla, 1)
+        self.assertEquals(age.percentiles[0.95] > timedelta(days = 1), True)
+        self.assertEquals(age.percentiles[0.5] < timedelta(days = 1), True)
+
+        # 10 objects, 4 older than 60s & 1 older than 300s.
+        self.assertAlmostEqual(
+            estimate_age(10, 600, [(60, 4), (300, 1)], 0.5), 50
+        )
+        self.assertAlmostEqual(
+            estimate_age(10, 600, [(60, 4), (300, 1)], 0.9), 300
+        )
+
+        logged_in = self.client.login(username = 'moder', password = 'moder')
+        self.assertEquals(logged_in, True)
+        response = self.client.get(
+            '/admin/django_monitor/monitorentry/stats/?sla=24'
+        )
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.context['rows']), 1)
+        # Out of range SLAs are clamped.
+        for sla in ('inf', '1e20', '-5', 'nan', 'x'):
+            response = self.client.get(
+                '/admin/django_monitor/monitorentry/stats/?sla=%s' % sla
+            )
+            self.assertEquals(response.status_code, 200)
+        self.client.logout()
@@ -1,11 +1,19 @@
 
+from collections import Counter, namedtuple
+from contextlib import contextmanager
 from datetime import datetime
+try:
+    from threading import local
+except ImportError:
+    from django.utils._threading_local import local
 
+from django.db import IntegrityError, router, transaction
 from django.db.models import Manager
 
+from django_monitor.instrument import measured
 from django_monitor.middleware import get_current_user
 from django_monitor.conf import (STATUS_DICT, PENDING_STATUS, APPROVED_STATUS,
-                                 CHALLENGED_STATUS)
+                                 CHALLENGED_STATUS, CHUNK_SIZE)
 
 
 def create_moderate_perms(sender, verbosity=0, **kwargs):
@@ -28,27 +36,176 @@ def create_moderate_perms(sender, verbosity=0, **kwargs):
             print "Adding permission '%s'" % p
 
 
+# Marks the bulk deletes in progress. See ``bulk_deleting``.
+_bulk_delete = local()
+
+MonitorMeta = namedtuple('MonitorMeta', [
+    'model',
+    'content_type_id',
+    # ``moderate_<model>`` and the permission string to check it with.
+    'perm_codename',
+    'perm',
+    # (parent model, its content_type_id, attname of the ancestor link) for
+    # each monitored parent.
+    'parents',
+    # (rel_name, query name, related model) for each of ``rel_fields``.
+    'rel_fields',
+])
+
+
+def compile_monitor_meta(model):
+    """
+    Resolves everything the signal handlers and bulk operations need about an
+    enqueued model, so that they need not look it up on every call.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from django_monitor import model_from_queue
+
+    opts = model._meta
+    codename = 'moderate_%s' % opts.object_name.lower()
+    parents = tuple(
+        (
+            parent, ContentType.objects.get_for_model(parent).id,
+            opts.get_ancestor_link(parent).attname
+        )
+        for parent in opts.parents.keys() if model_from_queue(parent)
+    )
+    rel_fields = tuple(
+        (rel_name,) + get_rel_field(model, rel_name)
+        for rel_name in model_from_queue(model)['rel_fields']
+    )
+    return MonitorMeta(
+        model = model,
+        content_type_id = ContentType.objects.get_for_model(model).id,
+        perm_codename = codename,
+        perm = '%s.%s' % (opts.app_label.lower(), codename),
+        parents = parents,
+        rel_fields = rel_fields,
+    )
+
+
 def add_fields(cls, manager_name, status_name, monitor_name, base_manager):
     """ Add additional fields like status to moderated models"""
+    from django.contrib.contenttypes.fields import GenericRelation
+    from django_monitor.models import MONITOR_RELATION
 
+    # Lets querysets join the monitor entries only when status is needed.
+    cls.add_to_class(
+        MONITOR_RELATION, GenericRelation('django_monitor.MonitorEntry')
+    )
     cls.add_to_class(monitor_name, property(cls._get_monitor_entry))
     cls.add_to_class('monitor_status', property(cls._get_monitor_status))
     cls.add_to_class(status_name, lambda self: self.monitor_status)
     cls.add_to_class(
         'get_monitor_status_display', cls._get_status_display
     )
-    # We have a custom filter defined in django_monitor.filter to enable
-    # filtering of model objects by their moderation status.
-    # But `status` is not a real field and Django does not support filters
-    # on non-fields as of now. Our way out is to attach the filter to some
-    # other field which the developer may never include in ``list_filter``.
 
-    # Used ``pk`` before but subclassed models raise FieldDoesNotExist here.
-    # So let's use ``id``. Latest Django dev-version has undergone changes to
-    # allow non-fields. So this hack must be for a short period of time.
-    cls._meta.get_field('id').monitor_filter = True
+
+def get_auto_status(model, user):
+    """
+    Status for new objects of ``model`` created by ``user``: Approved if the
+    user has ``moderate`` permission, In Pending otherwise.
+    """
+    from django_monitor import get_monitor_meta
+
+    if user and user.has_perm(get_monitor_meta(model).perm):
+        return APPROVED_STATUS
+    return PENDING_STATUS
 
 
+def create_monitor_entries(model, objs, user = None, batch_size = None,
+                           using = None):
+    """
+    Creates the monitor entries of freshly inserted ``model`` objects (from
+    ``bulk_create``) with one bulk insert, in the auto-moderation status for
+    ``user``. Related objects given in ``rel_fields`` are moderated as well.
+    """
+    from django_monitor import get_monitor_meta
+    from django_monitor.models import (
+        MonitorEntry, MonitorCounter, MonitorEvent
+    )
+
+    pks = [obj.pk for obj in objs]
+    if not pks:
+        return []
+    meta = get_monitor_meta(model)
+    status = get_auto_status(model, user)
+    now = datetime.now()
+    with transaction.atomic(using = using):
+        entries = MonitorEntry.objects.using(using).bulk_create([
+            MonitorEntry(
+                content_type_id = meta.content_type_id, object_id = pk,
+                status = status, status_by = user, status_date = now,
+                timestamp = now
+            )
+            for pk in pks
+        ], batch_size = batch_size)
+        MonitorCounter.objects.db_manager(using).change(
+            meta.content_type_id, status, len(pks)
+        )
+        MonitorEvent.objects.db_manager(using).record(
+            meta.content_type_id, [(pk, None) for pk in pks], status, user,
+            timestamp = now
+        )
+
+    # Moderate related objects too...
+    if meta.rel_fields:
+        cascade_rel_objects(model, pks, status, user, using)
+    if needs_pk_list(model):
+        send_bulk_signals(model, pks, status, user, using)
+    return entries
+
+
+def create_monitor_entry(model, object_id, status, user = None,
+                         instance = None, using = None):
+    """
+    Creates the monitor entry of the given object, complete with status, in
+    a single INSERT. If there is one already, it is moderated instead.
+    ``post_moderation`` is sent with ``instance`` if given, so that the
+    object need not be fetched again.
+    """
+    from django_monitor import get_monitor_meta, post_moderation
+    from django_monitor.models import (
+        MonitorEntry, MonitorCounter, MonitorEvent
+    )
+
+    ct_id = get_monitor_meta(model).content_type_id
+    now = datetime.now()
+    me = MonitorEntry(
+        content_type_id = ct_id, object_id = object_id, status = status,
+        status_by = user, status_date = now, timestamp = now
+    )
+    old_status = None
+    try:
+        # The entry & its counter in one savepoint, so that a failed INSERT
+        # does not break an outer transaction.
+        with transaction.atomic(using = using):
+            me.save(using = using)
+    except IntegrityError:
+        # The object is already monitored.
+        me = MonitorEntry.objects.using(using).get(
+            content_type = ct_id, object_id = object_id
+        )
+        old_status = me.status
+        me.status = status
+        me.status_by = user
+        me.status_date = now
+        me.notes = ''
+        me.save(using = using)
+        MonitorCounter.objects.db_manager(using).decide(
+            ct_id, status, [me.timestamp], now
+        )
+    MonitorEvent.objects.db_manager(using).record(
+        ct_id, [(object_id, old_status)], status, user, timestamp = now
+    )
+    if post_moderation.has_listeners(model):
+        if instance is None:
+            instance = model._base_manager.using(using).get(pk = object_id)
+        post_moderation.send(sender = model, instance = instance)
+    return me
+
+
+@measured('save_handler')
 def save_handler(sender, instance, **kwargs):
     """
     The following things are done after creating an object in moderated class:
@@ -56,113 +213,394 @@ def save_handler(sender, instance, **kwargs):
     2. Auto-approves object, its parents & specified related objects if user
        has ``moderate`` permission. Otherwise, they are put in pending.
     """
-    import django_monitor
-    from django_monitor.models import MonitorEntry
-    from django.contrib.contenttypes.models import ContentType
-
-    # Auto-moderation
-    user = get_current_user()
-    opts = instance.__class__._meta
-    mod_perm = '%s.moderate_%s' % (
-        opts.app_label.lower(), opts.object_name.lower()
-    )
-    if user and user.has_perm(mod_perm):
-        status = APPROVED_STATUS
-    else:
-        status = PENDING_STATUS
+    from django_monitor import get_monitor_meta
 
     # Create corresponding monitor entry
     if kwargs.get('created', None):
-        me = MonitorEntry.objects.create(
-            status = status,
-            content_object = instance,
-            timestamp = datetime.now()
+        # Auto-moderation
+        user = get_current_user()
+        status = get_auto_status(sender, user)
+
+        using = kwargs.get('using')
+
+        # The entry is cached on the instance, no need to query it again.
+        instance._monitor_entry = create_monitor_entry(
+            sender, instance.pk, status, user, instance, using
         )
-        me.moderate(status, user)
 
         # Create one monitor_entry per moderated parent.
-        monitored_parents = filter(
-            lambda x: django_monitor.model_from_queue(x),
-            instance._meta.parents.keys()
-        )
-        for parent in monitored_parents:
-            parent_ct = ContentType.objects.get_for_model(parent)
-            parent_pk_field = instance._meta.get_ancestor_link(parent)
-            parent_pk = getattr(instance, parent_pk_field.attname)
-            try:
-                me = MonitorEntry.objects.get(
-                    content_type = parent_ct, object_id = parent_pk
-                )
-            except MonitorEntry.DoesNotExist:
-                me = MonitorEntry(
-                    content_type = parent_ct, object_id = parent_pk,
+        meta = get_monitor_meta(sender)
+        for parent, parent_ct_id, parent_attname in meta.parents:
+            create_monitor_entry(
+                parent, getattr(instance, parent_attname), status, user,
+                using = using
+            )
+
+        # Moderate related objects too... Related managers (reverse & many
+        # to many relations) of an object just created are still empty.
+        for rel_name, query_name, rel_model in meta.rel_fields:
+            rel_obj = getattr(instance, rel_name, None)
+            if rel_obj and not hasattr(rel_obj, 'all'):
+                moderate_rel_objects(rel_obj, status, user)
+
+
+def needs_pk_list(model):
+    """
+    Returns True if a bulk moderation of ``model`` objects has to know the
+    exact pks, ie. somebody is listening to the moderation signals.
+    """
+    from django_monitor import (
+        model_from_queue, post_moderation, post_bulk_moderation
+    )
+    model_dict = model_from_queue(model)
+    return post_bulk_moderation.has_listeners(model) or bool(
+        model_dict and model_dict['instance_signals'] and
+        post_moderation.has_listeners(model)
+    )
+
+
+def send_bulk_signals(model, pks, status, user = None, using = None):
+    """
+    Sends ``post_bulk_moderation`` once for the given pks of ``model``. The
+    per-instance ``post_moderation`` is sent too if the model was enqueued
+    with ``instance_signals = True``.
+    """
+    from django_monitor import (
+        model_from_queue, post_moderation, post_bulk_moderation
+    )
+    post_bulk_moderation.send(
+        sender = model, pks = pks, status = status, user = user
+    )
+    model_dict = model_from_queue(model)
+    if (
+        model_dict and model_dict['instance_signals'] and
+        post_moderation.has_listeners(model)
+    ):
+        for instance in model._base_manager.using(using).filter(pk__in = pks):
+            post_moderation.send(sender = model, instance = instance)
+
+
+def chunked(items, size = None):
+    """ Yields successive lists of at most ``size`` items from ``items``."""
+    size = size or CHUNK_SIZE
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def update_entries(content_type_id, object_ids, status, changes,
+                   using = None):
+    """
+    Apply ``changes`` to the monitor entries of the given content type and
+    object ids (list or subquery), and keep MonitorCounter in sync. Returns
+    the number of entries updated.
+    The entries are read once before they change, to move the counters and
+    to append the decisions to MonitorEvent and count them in MonitorCounter
+    & MonitorLatency. They are then updated with a single UPDATE.
+    """
+    from django_monitor.models import (
+        MonitorEntry, MonitorCounter, MonitorEvent
+    )
+
+    rows = list(MonitorEntry.objects.using(using).filter(
+        content_type = content_type_id, object_id__in = object_ids
+    ).values_list('object_id', 'status', 'timestamp'))
+    if not rows:
+        return 0
+    count = MonitorEntry.objects.using(using).filter(
+        content_type = content_type_id,
+        object_id__in = [row[0] for row in rows]
+    ).update(**changes)
+    counters = MonitorCounter.objects.db_manager(using)
+    for old_status, num in Counter(row[1] for row in rows).items():
+        if old_status != status:
+            counters.transition(content_type_id, old_status, status, num)
+    MonitorEvent.objects.db_manager(using).record(
+        content_type_id, [row[:2] for row in rows], status,
+        changes.get('status_by'), changes.get('notes', ''),
+        changes.get('status_date')
+    )
+    counters.decide(
+        content_type_id, status, [row[2] for row in rows],
+        changes.get('status_date') or datetime.now()
+    )
+    return count
+
+
+@measured('bulk_moderate', objects = lambda count: count)
+def bulk_moderate(model, pks, status, user = None, notes = '', using = None):
+    """
+    Moderate the ``model`` objects with the given pks and their monitored
+    parents with one UPDATE per content type (per chunk). ``pks`` may
+    be a list or a subquery (``values('pk')`` queryset). Long lists are
+    updated in chunks. Returns the number of objects moderated.
+    """
+    from django_monitor import get_monitor_meta
+
+    if isinstance(pks, (list, tuple, set, frozenset)):
+        pks = list(pks)
+        pk_chunks = chunked(pks)
+    else:
+        pk_chunks = [pks]
+    changes = {
+        'status': status,
+        'status_by': user,
+        'status_date': datetime.now(),
+        'notes': notes,
+        'claimed_by': None,
+        'claimed_until': None,
+    }
+    meta = get_monitor_meta(model)
+    parent_pks = dict((parent[0], []) for parent in meta.parents)
+    count = 0
+    for chunk in pk_chunks:
+        objects = model._base_manager.using(using).filter(pk__in = chunk)
+        with transaction.atomic(using = using):
+            # Parents go first. The pks may be a subquery filtered by status
+            # and would not match any more once the entries of the objects
+            # themselves change.
+            for parent, parent_ct_id, parent_attname in meta.parents:
+                chunk_parent_pks = objects.values(parent_attname)
+                if needs_pk_list(parent):
+                    chunk_parent_pks = list(
+                        objects.values_list(parent_attname, flat = True)
+                    )
+                    parent_pks[parent].extend(chunk_parent_pks)
+                update_entries(
+                    parent_ct_id, chunk_parent_pks, status, changes, using
                 )
-            me.moderate(status, user)
+            count += update_entries(
+                meta.content_type_id, chunk, status, changes, using
+            )
+
+    for parent in parent_pks:
+        if needs_pk_list(parent):
+            send_bulk_signals(parent, parent_pks[parent], status, user, using)
+    if needs_pk_list(model) and isinstance(pks, list):
+        send_bulk_signals(model, pks, status, user, using)
+    return count
+
+
+def prefetch_monitor_entries(instances, select_status_by = False,
+                             using = None):
+    """
+    Loads the monitor entries for a list of moderated objects, one query per
+    model (per chunk of objects), and caches them on the objects. Accessing
+    ``monitor_entry`` on any of them needs no further query afterwards.
+    Pass ``select_status_by = True`` to load ``status_by`` users as well.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from django_monitor.models import MonitorEntry
+
+    by_model = {}
+    for obj in instances:
+        by_model.setdefault(obj.__class__, []).append(obj)
+    for model, objects in by_model.items():
+        ct = ContentType.objects.get_for_model(model)
+        entries = {}
+        for chunk in chunked(objects):
+            qset = MonitorEntry.objects.using(using).filter(
+                content_type = ct, object_id__in = [obj.pk for obj in chunk]
+            )
+            if select_status_by:
+                qset = qset.select_related('status_by')
+            for me in qset:
+                entries[me.object_id] = me
+        for obj in objects:
+            obj._monitor_entry = entries.get(obj.pk)
+    return instances
+
+
+def get_rel_field(model, rel_name):
+    """
+    Returns the query name and the model of the relation ``rel_name``, which
+    is the attribute name used in ``rel_fields``. Both forward fields and
+    reverse accessors (``related_name``) are allowed.
+    """
+    from django.core.exceptions import ImproperlyConfigured
+
+    for field in model._meta.get_fields():
+        if not field.is_relation or field.related_model is None:
+            continue
+        if field.auto_created and not field.concrete:
+            accessor = field.get_accessor_name()
+        else:
+            accessor = field.name
+        if accessor == rel_name:
+            return field.name, field.related_model
+    raise ImproperlyConfigured(
+        "'%s' in rel_fields of %s is not a relation." % (
+            rel_name, model._meta.object_name
+        )
+    )
+
+
+def collect_rel_objects(model, pks):
+    """
+    Walks ``rel_fields`` breadth-first from the given ``model`` objects and
+    returns a dict mapping each monitored model to the set of pks reached,
+    including the given ones. Every object is visited once, so shared and
+    cyclic relations are followed only once. Each relation costs one query
+    per level (per chunk of pks).
+    """
+    from django_monitor import get_monitor_meta, model_from_queue
 
-        # Moderate related objects too...
-        model = django_monitor.model_from_queue(instance.__class__)
-        if model:
-            for rel_name in model['rel_fields']:
-                rel_obj = getattr(instance, rel_name, None)
-                if rel_obj:
-                    moderate_rel_objects(rel_obj, status, user)
+    collected = {}
+    level = {model: set(pks)}
+    while level:
+        # Drop what has been visited already. This also ends cycles.
+        for level_model in list(level.keys()):
+            seen = collected.setdefault(level_model, set())
+            level[level_model] -= seen
+            if not level[level_model]:
+                del level[level_model]
+            else:
+                seen |= level[level_model]
+        next_level = {}
+        for level_model, level_pks in level.items():
+            meta = get_monitor_meta(level_model)
+            for rel_name, query_name, rel_model in meta.rel_fields:
+                if not model_from_queue(rel_model):
+                    continue
+                rel_pks = next_level.setdefault(rel_model, set())
+                for chunk in chunked(level_pks):
+                    rel_pks.update(
+                        pk for pk in level_model._base_manager.filter(
+                            pk__in = chunk
+                        ).values_list(query_name, flat = True)
+                        if pk is not None
+                    )
+        level = next_level
+    return collected
 
 
-def moderate_rel_objects(given, status, user = None):
+def cascade_rel_objects(model, pks, status, user = None, using = None):
+    """
+    Moderate the objects related to the ``model`` objects with the given
+    pks, but not those objects themselves. Returns the number of related
+    objects moderated.
+    """
+    collected = collect_rel_objects(model, pks)
+    collected[model] -= set(pks)
+    count = 0
+    for rel_model, rel_pks in collected.items():
+        if rel_pks:
+            count += bulk_moderate(
+                rel_model, rel_pks, status, user, using = using
+            )
+    return count
+
+
+@measured('moderate_rel_objects', objects = lambda count: count)
+def moderate_rel_objects(given, status, user = None, defer = False):
     """
     `given` can either be any model object or a queryset. Moderate given
-    object(s) and all specified related objects.
+    object(s) and all specified related objects. The related objects are
+    collected first (see ``collect_rel_objects``) and then moderated with
+    one bulk update per model. Returns the number of given objects moderated.
+    With ``defer``, only the given objects are moderated now. The related
+    objects are left to ``MonitorJob`` (run by ``manage.py monitor_jobs``).
     TODO: Permissions must be checked before each iteration.
     """
-    from django_monitor import model_from_queue
+    from django_monitor import get_monitor_meta
+    from django_monitor.models import MonitorJob
     # Not sure how we can find whether `given` is a queryset or object.
     # Now assume `given` is a queryset/related_manager if it has 'all'
     if not given:
         # given may become None. Stop there.
-        return
+        return 0
     if hasattr(given, 'all'):
         qset = given.all()
-        for obj in qset:
-            obj.moderate(status, user)
-            model = model_from_queue(qset.model)
-            if model:
-                for rel_name in model['rel_fields']:
-                    rel_obj = getattr(obj, rel_name, None)
-                    if rel_obj:
-                        moderate_rel_objects(rel_obj, status, user)
+        model = qset.model
+        meta = get_monitor_meta(model)
+        if not meta:
+            return 0
+        if not meta.rel_fields and hasattr(qset, 'moderate'):
+            # Nothing to cascade. Moderate the queryset as it is.
+            return qset.moderate(status, user)
+        pks = qset.values_list('pk', flat = True)
     else:
-        given.moderate(status, user)
-        model = model_from_queue(given.__class__)
-        if model:
-            for rel_name in model['rel_fields']:
-                rel_obj = getattr(given, rel_name, None)
-                if rel_obj:
-                    moderate_rel_objects(rel_obj, status, user)
+        model = given.__class__
+        if not get_monitor_meta(model):
+            return 0
+        pks = [given.pk]
+
+    if defer and get_monitor_meta(model).rel_fields:
+        # The pks are needed for the jobs, and the queryset may not match
+        # the objects any more once they are moderated.
+        pks = list(pks)
+        # No job may be lost, or left behind, if the other half fails.
+        using = router.db_for_write(model)
+        with transaction.atomic(using = using):
+            count = bulk_moderate(model, pks, status, user, using = using)
+            MonitorJob.objects.db_manager(using).enqueue(
+                model, pks, status, user
+            )
+        return count
+
+    collected = collect_rel_objects(model, pks)
+    count = 0
+    for rel_model, rel_pks in collected.items():
+        moderated = bulk_moderate(rel_model, rel_pks, status, user)
+        if rel_model is model:
+            count = moderated
+    return count
 
 
+@contextmanager
+def bulk_deleting():
+    """
+    Within this block, ``delete_handler`` leaves the monitor entries alone.
+    To be used by bulk deletes that remove the entries themselves.
+    """
+    previous = getattr(_bulk_delete, 'active', False)
+    _bulk_delete.active = True
+    try:
+        yield
+    finally:
+        _bulk_delete.active = previous
+
+
+def delete_entries(content_type_id, object_ids, using = None):
+    """
+    Deletes the monitor entries of the given content type and object ids in
+    chunks, with one DELETE per chunk, and keeps MonitorCounter in sync from
+    a grouped count of the entries. Returns the number of entries deleted.
+    """
+    from django.db.models import Count
+    from django_monitor.models import MonitorEntry, MonitorCounter
+
+    counters = MonitorCounter.objects.db_manager(using)
+    count = 0
+    for chunk in chunked(object_ids):
+        entries = MonitorEntry.objects.using(using).filter(
+            content_type = content_type_id, object_id__in = chunk
+        )
+        with transaction.atomic(using = using):
+            grouped = entries.order_by().values_list('status').annotate(
+                num = Count('pk')
+            )
+            for status, num in list(grouped):
+                counters.transition(content_type_id, status, None, num)
+            count += entries.delete()[0]
+    return count
+
+
+@measured('delete_handler')
 def delete_handler(sender, instance, **kwargs):
     """ When an instance is deleted, delete corresponding monitor_entries too"""
-    from django_monitor import model_from_queue
+    from django.db.models import Q
+    from django_monitor import get_monitor_meta
     from django_monitor.models import MonitorEntry
-    from django.contrib.contenttypes.models import ContentType
 
-    if model_from_queue(sender):
-        me = MonitorEntry.objects.get_for_instance(instance)
-        if me:
+    meta = get_monitor_meta(sender)
+    if meta and not getattr(_bulk_delete, 'active', False):
+        # Entries of the instance & its monitored parents, in one query.
+        lookup = Q(content_type = meta.content_type_id, object_id = instance.pk)
+        for parent, parent_ct_id, parent_attname in meta.parents:
+            lookup |= Q(
+                content_type = parent_ct_id,
+                object_id = getattr(instance, parent_attname)
+            )
+        for me in MonitorEntry.objects.using(kwargs.get('using')).filter(lookup):
             me.delete()
-        # Delete monitor_entries of parents too
-        monitored_parents = filter(
-            lambda x: model_from_queue(x),
-            instance._meta.parents.keys()
-        )
-        for parent in monitored_parents:
-            parent_ct = ContentType.objects.get_for_model(parent)
-            parent_pk_field = instance._meta.get_ancestor_link(parent)
-            parent_pk = getattr(instance, parent_pk_field.attname)
-            try:
-                me = MonitorEntry.objects.get(
-                    content_type = parent_ct, object_id = parent_pk
-                )
-                me.delete()
-            except MonitorEntry.DoesNotExist:
-                pass
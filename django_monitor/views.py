@@ -1,13 +1,11 @@
 from datetime import datetime
 
-from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect
 from django.views.generic.edit import ModelFormMixin
 
-from django_monitor import model_from_queue
-from .conf import PENDING_STATUS, APPROVED_STATUS
+from django_monitor import get_monitor_meta
 from .models import MonitorEntry
-from .util import moderate_rel_objects
+from .util import get_auto_status, moderate_rel_objects
 
 
 class MonitorMixin(ModelFormMixin):
@@ -18,13 +16,7 @@ class MonitorMixin(ModelFormMixin):
 
     def automoderate(self, object, user):
         """Automatically approve the object if the user has permission."""
-        opts = self.object.__class__._meta
-        mod_perm = '%s.moderate_%s' % (
-            opts.app_label.lower(), opts.object_name.lower()
-        )
-        if user and user.has_perm(mod_perm):
-            return APPROVED_STATUS
-        return PENDING_STATUS
+        return get_auto_status(self.object.__class__, user)
 
     def moderate_object(self, obj, user, status):
         """Moderate the given object"""
@@ -38,29 +30,25 @@ class MonitorMixin(ModelFormMixin):
 
     def moderate_parents(self, obj, user, status):
         """Create one monitor_entry per moderated parent"""
-        monitored_parents = filter(
-            lambda x: model_from_queue(x),
-            obj._meta.parents.keys()
-        )
-        for parent in monitored_parents:
-            parent_ct = ContentType.objects.get_for_model(parent)
-            parent_pk_field = obj._meta.get_ancestor_link(parent)
-            parent_pk = getattr(obj, parent_pk_field.attname)
+        for parent, parent_ct_id, parent_attname in (
+            get_monitor_meta(obj.__class__).parents
+        ):
+            parent_pk = getattr(obj, parent_attname)
             try:
                 me = MonitorEntry.objects.get(
-                    content_type = parent_ct, object_id = parent_pk
+                    content_type = parent_ct_id, object_id = parent_pk
                 )
             except MonitorEntry.DoesNotExist:
                 me = MonitorEntry(
-                    content_type = parent_ct, object_id = parent_pk,
+                    content_type_id = parent_ct_id, object_id = parent_pk,
                 )
             me.moderate(status, user)
 
     def moderate_related(self, obj, user, status):
         """Moderate related objects"""
-        model = model_from_queue(obj.__class__)
-        if model:
-            for rel_name in model['rel_fields']:
+        meta = get_monitor_meta(obj.__class__)
+        if meta:
+            for rel_name, query_name, rel_model in meta.rel_fields:
                 rel_obj = getattr(obj, rel_name, None)
                 if rel_obj:
                     moderate_rel_objects(rel_obj, status, user)
@@ -88,3 +76,12 @@ class MonitorMixin(ModelFormMixin):
         self.moderate_related(self.object, user, status)
 
         return HttpResponseRedirect(self.get_success_url())
+
+
+def metrics(request):
+    """
+    Serves the queue depths, decision counts and time-to-decision histograms
+    in the Prometheus text format. See ``django_monitor.metrics``.
+    """
+    from django_monitor.metrics import CONTENT_TYPE, render_metrics
+    return HttpResponse(render_metrics(), content_type = CONTENT_TYPE)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the moderation hot paths, on the models of the test_app in a
+fresh SQLite database. Reports the wall time & the number of SQL queries of
+each operation, to be compared between releases: ::
+
+    $ python runbenchmarks.py --rows 100000
+    $ python runbenchmarks.py --rows 1000000 --db /tmp/bench.db --json
+"""
+from collections import deque
+import json
+import os
+import sys
+from optparse import OptionParser
+from timeit import default_timer
+
+from runtests import setup_test_environment
+
+
+class Benchmark(object):
+    """ Runs operations & collects their time and query counts."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.results = []
+
+    def measure(self, name, func, ops = 1):
+        """
+        Runs ``func`` once, which performs ``ops`` operations, and records
+        the time & queries it took.
+        """
+        connection = self.connection
+        queries_log = connection.queries_log
+        force_debug_cursor = connection.force_debug_cursor
+        # Unbounded, Django keeps only the last 9000 queries.
+        connection.queries_log = deque()
+        connection.force_debug_cursor = True
+        try:
+            start = default_timer()
+            func()
+            elapsed = default_timer() - start
+            queries = len(connection.queries_log)
+        finally:
+            connection.queries_log = queries_log
+            connection.force_debug_cursor = force_debug_cursor
+        self.results.append({
+            'name': name,
+            'ops': ops,
+            'seconds': elapsed,
+            'ms_per_op': elapsed * 1000.0 / max(ops, 1),
+            'queries': queries,
+            'queries_per_op': queries / float(max(ops, 1)),
+        })
+
+    def report(self, stream):
+        stream.write('%-40s %9s %10s %10s %12s\n' % (
+            'operation', 'ops', 'seconds', 'ms/op', 'queries/op'
+        ))
+        for result in self.results:
+            stream.write('%-40s %9d %10.3f %10.3f %12.2f\n' % (
+                result['name'], result['ops'], result['seconds'],
+                result['ms_per_op'], result['queries_per_op']
+            ))
+
+
+def seed(rows, batch_size = 5000):
+    """
+    Creates ``rows`` authors, a tenth as many books with two supplements
+    each, and their monitor entries, with bulk inserts. The pks are given
+    explicitly, SQLite does not return them from bulk inserts. EBooks
+    (multi-table inheritance) can not be bulk inserted, a hundredth as many
+    are created one by one.
+    """
+    from django.db import transaction
+    from django_monitor.tests.test_app.models import (
+        Author, Book, EBook, Publisher, Supplement
+    )
+
+    publisher = Publisher.objects.create(name = 'bench', num_awards = 0)
+    for start in range(0, rows, batch_size):
+        Author.objects.bulk_create([
+            Author(pk = num + 1, name = 'author %d' % num, age = num % 90)
+            for num in range(start, min(start + batch_size, rows))
+        ])
+    books = max(rows // 10, 1)
+    for start in range(0, books, batch_size):
+        nums = range(start, min(start + batch_size, books))
+        Book.objects.bulk_create([
+            Book(
+                pk = num + 1, isbn = '%09d' % num, name = 'book %d' % num,
+                pages = 100, publisher = publisher
+            )
+            for num in nums
+        ])
+        Supplement.objects.bulk_create([
+            Supplement(
+                pk = 2 * num + serial, serial_num = serial, book_id = num + 1
+            )
+            for num in nums for serial in (1, 2)
+        ])
+    with transaction.atomic():
+        for num in range(max(rows // 100, 1)):
+            ebook = EBook.objects.create(
+                isbn = 'e%08d' % num, name = 'ebook %d' % num, pages = 100,
+                publisher = publisher
+            )
+            Supplement.objects.create(serial_num = 1, book = ebook)
+    return publisher
+
+
+def run(rows, sample):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+
+    from django_monitor.conf import APPROVED_STATUS
+    from django_monitor.middleware import acting_user
+    from django_monitor.tests.test_app.models import (
+        Author, Book, EBook, Supplement
+    )
+    from django_monitor.util import moderate_rel_objects
+
+    moderator = User.objects.create_superuser(
+        'bench', 'bench@monitor.com', 'bench'
+    )
+    bench = Benchmark(connection)
+    bench.measure('seed (bulk_create) %d rows' % rows, lambda: seed(rows))
+
+    def create_authors():
+        for num in range(sample):
+            Author.objects.create(name = 'new %d' % num, age = 30)
+    bench.measure('create (save_handler)', create_authors, sample)
+
+    def create_approved():
+        with acting_user(moderator):
+            for num in range(sample):
+                Author.objects.create(name = 'approved %d' % num, age = 30)
+    bench.measure('create, auto-approved', create_approved, sample)
+
+    pending = list(Author.objects.pending().order_by('pk').values_list(
+        'pk', flat = True
+    )[:sample])
+    bench.measure(
+        'bulk approve %d authors' % len(pending),
+        lambda: Author.objects.filter(pk__in = pending).approve(moderator),
+        len(pending)
+    )
+
+    books = list(Book.objects.pending().order_by('pk').values_list(
+        'pk', flat = True
+    )[:sample])
+    bench.measure(
+        'cascade approve %d books' % len(books),
+        lambda: moderate_rel_objects(
+            Book.objects.filter(pk__in = books), APPROVED_STATUS, moderator
+        ),
+        len(books)
+    )
+
+    def create_ebooks():
+        for num in range(sample):
+            EBook.objects.create(
+                isbn = 'n%08d' % num, name = 'new %d' % num, pages = 100,
+                publisher_id = publisher_id
+            )
+    publisher_id = Book.objects.values_list('publisher', flat = True)[0]
+    bench.measure('create ebook (multi-table)', create_ebooks, sample)
+
+    ebooks = list(EBook.objects.pending().order_by('pk').values_list(
+        'pk', flat = True
+    )[:sample])
+    bench.measure(
+        'bulk approve %d ebooks & parents' % len(ebooks),
+        lambda: EBook.objects.filter(pk__in = ebooks).approve(moderator),
+        len(ebooks)
+    )
+    ebooks = list(EBook.objects.pending().order_by('pk').values_list(
+        'pk', flat = True
+    )[:sample])
+    bench.measure(
+        'cascade approve %d ebooks' % len(ebooks),
+        lambda: moderate_rel_objects(
+            EBook.objects.filter(pk__in = ebooks), APPROVED_STATUS, moderator
+        ),
+        len(ebooks)
+    )
+
+    book = Book.objects.create(
+        isbn = 'single', name = 'single', pages = 100,
+        publisher_id = publisher_id
+    )
+    for serial in (1, 2):
+        Supplement.objects.create(serial_num = serial, book = book)
+    bench.measure(
+        'approve 1 book & supplements',
+        lambda: moderate_rel_objects(book, APPROVED_STATUS, moderator)
+    )
+
+    client = Client()
+    client.login(username = 'bench', password = 'bench')
+    bench.measure(
+        'moderation queue (dashboard)',
+        lambda: client.get('/admin/django_monitor/monitorentry/')
+    )
+    bench.measure(
+        'changelist, pending authors',
+        lambda: client.get('/admin/test_app/author/?status=IP')
+    )
+    bench.measure(
+        'changelist, approved authors',
+        lambda: client.get('/admin/test_app/author/?status=AP')
+    )
+    return bench
+
+
+def runbenchmarks():
+    parser = OptionParser(usage = '%prog [options]')
+    parser.add_option(
+        '--rows', type = 'int', default = 10000,
+        help = 'Number of authors to seed (10000 - 1000000).'
+    )
+    parser.add_option(
+        '--sample', type = 'int', default = 500,
+        help = 'Number of objects created / moderated per operation.'
+    )
+    parser.add_option(
+        '--db', default = ':memory:',
+        help = 'SQLite database file. Defaults to an in-memory database.'
+    )
+    parser.add_option(
+        '--json', action = 'store_true', default = False,
+        help = 'Print the results as JSON.'
+    )
+    options, args = parser.parse_args()
+
+    setup_test_environment()
+    from django.conf import settings
+    settings.DATABASES['default']['TEST'] = {'NAME': options.db}
+    parent = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, parent)
+
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import (
+        setup_test_environment as setup_django_test_environment
+    )
+    setup_django_test_environment()
+    connection.creation.create_test_db(
+        verbosity = 0, autoclobber = True, serialize = False
+    )
+
+    bench = run(options.rows, options.sample)
+    if options.json:
+        json.dump(bench.results, sys.stdout, indent = 2)
+        sys.stdout.write('\n')
+    else:
+        bench.report(sys.stdout)
+
+if __name__ == "__main__":
+    """Benchmarks of the app, django_monitor, are run from here."""
+    runbenchmarks()